@@ -1,5 +1,32 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+
 from django.apps import AppConfig
 
 
 class DownloaderConfig(AppConfig):
     name = 'downloader'
+
+    def ready(self):
+        self._start_log_queue()
+
+    def _start_log_queue(self):
+        """Move the downloader logger's handlers onto a background thread
+
+        The logger keeps only a QueueHandler, so peer and piece threads just
+        enqueue records and a QueueListener does the console/file I/O.
+        """
+        logger = logging.getLogger('downloader')
+        handlers = logger.handlers[:]
+        if not handlers or any(isinstance(h, logging.handlers.QueueHandler) for h in handlers):
+            return  # Nothing configured, or already set up
+
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener.start()
+        atexit.register(listener.stop)
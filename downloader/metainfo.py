@@ -0,0 +1,60 @@
+"""
+Torrent Metainfo Helpers
+Works on raw .torrent bytes without decoding them
+"""
+
+import hashlib
+
+try:
+    # C extension, much faster on large torrents and tracker responses
+    from better_bencode import loads as bdecode
+except ImportError:
+    from bencodepy import decode as bdecode
+
+
+def info_hash_from_torrent(data):
+    """Compute the info-hash from raw .torrent bytes
+
+    Hashes the info dictionary exactly as it appears in the file, so the
+    result matches what trackers and peers expect even when re-encoding
+    the decoded dictionary would not reproduce the original bytes.
+    """
+    try:
+        if data[:1] != b'd':
+            raise ValueError("torrent is not a bencoded dictionary")
+        
+        pos = 1
+        while data[pos] != 0x65:  # 'e' closes the top-level dictionary
+            colon = data.index(b':', pos)
+            key_end = colon + 1 + int(data[pos:colon])
+            value_end = _skip_value(data, key_end)
+            
+            if data[colon + 1:key_end] == b'info':
+                info = memoryview(data)[key_end:value_end]
+                return hashlib.sha1(info, usedforsecurity=False).hexdigest()
+            pos = value_end
+    except IndexError:
+        raise ValueError("truncated torrent data")
+    
+    raise ValueError("torrent has no info dictionary")
+
+
+def _skip_value(data, pos):
+    """Return the index just past the bencoded value starting at pos"""
+    depth = 0
+    while True:
+        c = data[pos]
+        if c == 0x64 or c == 0x6c:  # 'd' / 'l' open a container
+            depth += 1
+            pos += 1
+        elif c == 0x65:  # 'e' closes one
+            depth -= 1
+            pos += 1
+        elif c == 0x69:  # 'i<digits>e'
+            pos = data.index(b'e', pos) + 1
+        else:  # '<length>:<bytes>'
+            colon = data.index(b':', pos)
+            pos = colon + 1 + int(data[pos:colon])
+        
+        if depth == 0:
+            return pos
@@ -3,22 +3,57 @@ BitTorrent Peer Wire Protocol Implementation
 Handles peer connections, piece requests, and data transfer
 """
 
+import logging
+import selectors
 import socket
 import struct
 import threading
 import time
 from collections import deque
 
+from .piece_manager import PieceManager
+
+
+log = logging.getLogger(__name__)
+
+# Precompiled wire formats (avoid re-parsing format strings per message)
+_LEN = struct.Struct(">I")
+_LEN_ID = struct.Struct(">IB")
+_REQ = struct.Struct(">IBIII")
+_PIECE_HDR = struct.Struct(">II")
+
+_INTERESTED = _LEN_ID.pack(1, 2)  # length=1, id=2 (interested)
+
+# Size of one piece message payload (header + one block)
+_BLOCK_BUF_SIZE = _PIECE_HDR.size + PieceManager.BLOCK_SIZE
+
+# Longest message we accept: a piece message carrying up to 8 blocks (peers
+# may honour requests larger than ours). Bitfields of torrents with very
+# many pieces can be longer; PeerConnection raises its limit for those.
+_MAX_MESSAGE_LENGTH = 1 + _PIECE_HDR.size + 8 * PieceManager.BLOCK_SIZE
+
+# Initial per-peer receive buffer (replaced for larger messages) and a
+# non-blocking recv flag where the platform has one
+_INBUF_SIZE = 4 * _BLOCK_BUF_SIZE
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+# Kernel socket buffer size for peer connections
+_SOCKET_BUF_SIZE = 1 << 20
+
 
 class PeerConnection:
     """Manages connection to a single peer"""
     
-    def __init__(self, peer_ip, peer_port, info_hash, peer_id, piece_manager):
+    REQUEST_WINDOW = 128  # Block requests kept outstanding per unchoked peer
+    
+    def __init__(self, peer_ip, peer_port, info_hash, peer_id, piece_manager, unchoke_event=None, pause_event=None):
         self.peer_ip = peer_ip
         self.peer_port = peer_port
         self.info_hash = info_hash
         self.peer_id = peer_id
         self.piece_manager = piece_manager
+        self.unchoke_event = unchoke_event  # Set when this peer unchokes us
+        self.pause_event = pause_event  # No new requests while set
         
         self.socket = None
         self.connected = False
@@ -31,20 +66,45 @@ class PeerConnection:
         self.pending_requests = deque()
         self.running = False
         
+        # Request pipeline, refilled as blocks arrive (see fill_pipeline);
+        # the I/O thread and the download loop both refill, hence the lock.
+        # (piece_index, offset) -> time requested, oldest first
+        self._requested = {}
+        self.window = self.REQUEST_WINDOW
+        self.snubbed = False  # Let requests time out; asked for one block at a time
+        self._request_lock = threading.Lock()
+        
         self.downloaded_bytes = 0
+        
+        # Incoming data is read by PeerIOLoop (see on_readable); unparsed
+        # bytes live in _inbuf[_in_start:_in_end]
+        self._io_loop = None
+        self._inbuf = None
+        self._in_start = 0
+        self._in_end = 0
+        num_pieces = getattr(piece_manager, 'num_pieces', 0)
+        self._max_message_length = max(_MAX_MESSAGE_LENGTH, 1 + (num_pieces + 7) // 8)
     
-    def connect(self):
-        """Establish connection to peer"""
+    def connect(self, interested=False):
+        """Establish connection to peer
+        
+        With interested=True the INTERESTED message is sent in the same
+        write as the handshake, saving a syscall and a round-trip.
+        """
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(15)
+            self._tune_socket()
             
-            print(f"[+] Connecting to peer {self.peer_ip}:{self.peer_port}...")
+            log.info("Connecting to peer %s:%s...", self.peer_ip, self.peer_port)
             self.socket.connect((self.peer_ip, self.peer_port))
             
             # Send handshake
             handshake = self._build_handshake()
+            if interested:
+                handshake += _INTERESTED
             self.socket.sendall(handshake)
+            self.interested = interested
             
             # Receive handshake response (need exactly 68 bytes)
             response = b''
@@ -57,16 +117,32 @@ class PeerConnection:
             if len(response) == 68:
                 self.connected = True
                 self.socket.settimeout(30)  # Longer timeout for data transfer
-                print(f"[+] Handshake successful with {self.peer_ip}:{self.peer_port}")
+                log.info("Handshake successful with %s:%s", self.peer_ip, self.peer_port)
                 return True
             else:
-                print(f"[!] Invalid handshake from {self.peer_ip}")
+                log.warning("Invalid handshake from %s", self.peer_ip)
                 return False
             
         except Exception as e:
-            print(f"[!] Connection to {self.peer_ip}:{self.peer_port} failed: {e}")
+            log.warning("Connection to %s:%s failed: %s", self.peer_ip, self.peer_port, e)
             return False
     
+    def _tune_socket(self):
+        """Set socket options before connecting (buffer sizes affect the TCP window)"""
+        options = [
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),  # Don't delay small requests
+            (socket.SOL_SOCKET, socket.SO_RCVBUF, _SOCKET_BUF_SIZE),
+            (socket.SOL_SOCKET, socket.SO_SNDBUF, _SOCKET_BUF_SIZE),
+        ]
+        if hasattr(socket, 'TCP_QUICKACK'):  # Linux only
+            options.append((socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1))
+        
+        for level, option, value in options:
+            try:
+                self.socket.setsockopt(level, option, value)
+            except OSError:
+                pass  # Best effort; the defaults still work
+    
     def _build_handshake(self):
         """Build BitTorrent handshake message"""
         protocol = b"BitTorrent protocol"
@@ -80,97 +156,184 @@ class PeerConnection:
     def send_interested(self):
         """Send interested message"""
         try:
-            msg = struct.pack(">IB", 1, 2)  # length=1, id=2 (interested)
-            self.socket.sendall(msg)
+            self.socket.sendall(_INTERESTED)
             self.interested = True
-            print(f"[+] Sent INTERESTED to {self.peer_ip}")
+            log.debug("Sent INTERESTED to %s", self.peer_ip)
         except Exception as e:
-            print(f"[!] Error sending interested: {e}")
+            log.warning("Error sending interested to %s: %s", self.peer_ip, e)
     
     def send_request(self, piece_index, block_offset, block_length):
         """Request a block from peer"""
         try:
-            msg_id = 6  # request
-            payload = struct.pack(">III", piece_index, block_offset, block_length)
-            length = 1 + len(payload)
-            msg = struct.pack(">IB", length, msg_id) + payload
+            # length=13, id=6 (request)
+            msg = _REQ.pack(13, 6, piece_index, block_offset, block_length)
             self.socket.sendall(msg)
-            # print(f"[+] Requested piece {piece_index} block at offset {block_offset}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Requested piece %d block at offset %d", piece_index, block_offset)
         except Exception as e:
-            print(f"[!] Error sending request: {e}")
+            log.warning("Error sending request to %s: %s", self.peer_ip, e)
             self.connected = False
     
-    def handle_messages(self):
-        """Process incoming messages from peer"""
-        self.running = True
+    def send_requests(self, block_requests):
+        """Request several blocks from peer with a single send"""
+        try:
+            msg = bytearray(_REQ.size * len(block_requests))
+            for i, (piece_index, block_offset, block_length) in enumerate(block_requests):
+                _REQ.pack_into(msg, i * _REQ.size, 13, 6, piece_index, block_offset, block_length)
+            self.socket.sendall(msg)
+        except Exception as e:
+            log.warning("Error sending requests to %s: %s", self.peer_ip, e)
+            self.connected = False
+    
+    def fill_pipeline(self):
+        """Request blocks until window requests are outstanding
+        
+        Called on unchoke and whenever blocks arrive, so the peer always has
+        requests queued; does nothing while the torrent is paused. Returns
+        the number of requests sent.
+        """
+        if self.pause_event is not None and self.pause_event.is_set():
+            return 0
+        with self._request_lock:
+            if not self.connected or self.peer_choking:
+                return 0
+            
+            now = time.monotonic()
+            self._expire_requests(now)
+            
+            window = 1 if self.snubbed else self.window
+            batch = {}  # (piece_index, offset) -> request
+            while self.outstanding_requests + len(batch) < window:
+                request = self.piece_manager.get_next_request()
+                if request is None:
+                    break  # Nothing left to hand out right now
+                key = request[:2]
+                if key in batch:
+                    break  # Endgame handed the same blocks out again
+                if key not in self._requested:
+                    # In endgame blocks already requested from this peer
+                    # come back; asking it twice gains nothing
+                    batch[key] = request
+            
+            if batch:
+                self.send_requests(list(batch.values()))
+                # New keys only, so _requested stays ordered oldest first
+                self._requested.update(dict.fromkeys(batch, now))
+            return len(batch)
+    
+    @property
+    def outstanding_requests(self):
+        """Number of requested blocks this peer has not delivered yet"""
+        return len(self._requested)
+    
+    def _expire_requests(self, now):
+        """Give up on requests unanswered for REQUEST_TIMEOUT (caller holds _request_lock)
+        
+        Frees their pipeline slots and hands the blocks back to the piece
+        manager so another peer can fetch them right away. The peer is
+        snubbed so it doesn't simply take them back.
+        """
+        timeout = self.piece_manager.REQUEST_TIMEOUT
+        expired = []
+        for key, requested_at in self._requested.items():
+            if now - requested_at < timeout:
+                break  # Oldest first, so the rest are newer
+            expired.append(key)
+        
+        if expired:
+            for key in expired:
+                del self._requested[key]
+            self.snubbed = True
+            self.piece_manager.release_requests(expired)
+    
+    def _release_all_requests(self):
+        """Hand every outstanding request back to the piece manager"""
+        with self._request_lock:
+            released = list(self._requested)
+            self._requested.clear()
+        if released:
+            self.piece_manager.release_requests(released)
+    
+    def on_readable(self):
+        """Read available data and handle every complete message
+        
+        Called by PeerIOLoop when the socket is readable. Returns False
+        once the connection should be dropped.
+        """
+        if self._inbuf is None:
+            self._inbuf = bytearray(_INBUF_SIZE)
         
         try:
-            while self.running and self.connected:
-                # Read message length (4 bytes)
-                length_bytes = self._recv_exact(4)
-                if not length_bytes:
-                    print(f"[!] Peer {self.peer_ip} closed connection")
-                    break
-                
-                length = struct.unpack(">I", length_bytes)[0]
-                
-                if length == 0:  # Keep-alive
-                    continue
-                
-                # Read message ID (1 byte)
-                msg_id_bytes = self._recv_exact(1)
-                if not msg_id_bytes:
-                    break
-                
-                msg_id = struct.unpack("B", msg_id_bytes)[0]
-                
-                # Read payload
-                payload_length = length - 1
-                payload = b''
-                
-                if payload_length > 0:
-                    payload = self._recv_exact(payload_length)
-                    if not payload or len(payload) != payload_length:
-                        print(f"[!] Incomplete payload from {self.peer_ip}")
-                        break
-                
-                self._handle_message(msg_id, payload)
-                
-        except socket.timeout:
-            print(f"[!] Timeout reading from {self.peer_ip}")
+            n = self.socket.recv_into(memoryview(self._inbuf)[self._in_end:], 0, _MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return True
         except Exception as e:
-            print(f"[!] Error in message loop for {self.peer_ip}: {e}")
-        finally:
-            self.close()
-    
-    def _recv_exact(self, num_bytes):
-        """Receive exactly num_bytes from socket"""
-        data = b''
-        while len(data) < num_bytes:
-            try:
-                chunk = self.socket.recv(num_bytes - len(data))
-                if not chunk:
-                    return None
-                data += chunk
-            except socket.timeout:
-                if len(data) == 0:
-                    raise
-                continue
-            except Exception as e:
-                print(f"[!] Error receiving data: {e}")
-                return None
-        return data
+            log.warning("Error receiving data from %s: %s", self.peer_ip, e)
+            return False
+        
+        if not n:
+            log.info("Peer %s closed connection", self.peer_ip)
+            return False
+        
+        self._in_end += n
+        if not self._process_inbuf():
+            return False
+        # One batched refill for every block decoded from this read
+        self.fill_pipeline()
+        return self.connected
+    
+    def _process_inbuf(self):
+        """Decode complete length-prefixed messages from the receive buffer
+        
+        Returns False if the peer announced a message longer than any legal
+        one; the buffer would otherwise be sized from its length prefix.
+        """
+        buf = self._inbuf
+        view = memoryview(buf)
+        pos = self._in_start
+        end = self._in_end
+        needed = 0
+        
+        while end - pos >= 4:
+            length = _LEN.unpack_from(buf, pos)[0]
+            if length > self._max_message_length:
+                log.warning("Peer %s sent an oversized message (%d bytes), dropping it",
+                            self.peer_ip, length)
+                return False
+            if end - pos - 4 < length:
+                needed = 4 + length  # Wait for the rest of this message
+                break
+            if length:  # Zero length is a keep-alive
+                self._handle_message(buf[pos + 4], view[pos + 5:pos + 4 + length])
+            pos += 4 + length
+        
+        # Move the partial message to the front so the next recv has room;
+        # the buffer is only replaced (never resized) since views may exist
+        remaining = end - pos
+        if needed > len(buf):
+            new_buf = bytearray(needed)
+            new_buf[:remaining] = buf[pos:end]
+            self._inbuf = new_buf
+        elif pos:
+            buf[:remaining] = buf[pos:end]
+        self._in_start = 0
+        self._in_end = remaining
+        return True
     
     def _handle_message(self, msg_id, payload):
         """Handle different message types"""
         try:
             if msg_id == 0:  # choke
                 self.peer_choking = True
-                print(f"[!] CHOKED by {self.peer_ip}")
+                # A choking peer discards our requests; let other peers have them
+                self._release_all_requests()
+                log.debug("CHOKED by %s", self.peer_ip)
                 
             elif msg_id == 1:  # unchoke
                 self.peer_choking = False
-                print(f"[+] UNCHOKED by {self.peer_ip} - can now download!")
+                if self.unchoke_event is not None:
+                    self.unchoke_event.set()
+                log.debug("UNCHOKED by %s - can now download!", self.peer_ip)
                 
             elif msg_id == 2:  # interested
                 self.peer_interested = True
@@ -180,37 +343,115 @@ class PeerConnection:
                 
             elif msg_id == 4:  # have
                 if len(payload) >= 4:
-                    piece_index = struct.unpack(">I", payload)[0]
-                    # print(f"[+] Peer {self.peer_ip} has piece {piece_index}")
+                    piece_index = _LEN.unpack_from(payload)[0]
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("Peer %s has piece %d", self.peer_ip, piece_index)
                 
             elif msg_id == 5:  # bitfield
-                self.bitfield = payload
-                print(f"[+] Received bitfield from {self.peer_ip} ({len(payload)} bytes)")
+                self.bitfield = bytes(payload)
+                log.debug("Received bitfield from %s (%d bytes)", self.peer_ip, len(payload))
                 
             elif msg_id == 7:  # piece
                 if len(payload) >= 8:
-                    index, offset = struct.unpack(">II", payload[:8])
-                    block_data = payload[8:]
+                    index, offset = _PIECE_HDR.unpack_from(payload, 0)
+                    block_data = memoryview(payload)[8:]
                     
                     self.downloaded_bytes += len(block_data)
-                    print(f"[+] Received piece {index} block (offset {offset}, size {len(block_data)}) from {self.peer_ip}")
+                    with self._request_lock:
+                        self._requested.pop((index, offset), None)
+                        self.snubbed = False
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("Received piece %d block (offset %d, size %d) from %s",
+                                  index, offset, len(block_data), self.peer_ip)
                     
                     # Add to piece manager
                     self.piece_manager.add_block(index, offset, block_data)
                 else:
-                    print(f"[!] Invalid piece message from {self.peer_ip}")
+                    log.warning("Invalid piece message from %s", self.peer_ip)
                     
         except Exception as e:
-            print(f"[!] Error handling message type {msg_id} from {self.peer_ip}: {e}")
+            log.warning("Error handling message type %d from %s: %s", msg_id, self.peer_ip, e)
     
     def close(self):
         """Close connection to peer"""
         self.running = False
+        self._release_all_requests()
+        if self._io_loop:
+            self._io_loop.unregister(self)
         if self.socket:
             try:
                 self.socket.close()
             except:
                 pass
         self.connected = False
-        print(f"[+] Closed connection to {self.peer_ip} (downloaded {self.downloaded_bytes} bytes)")
+        log.info("Closed connection to %s (downloaded %d bytes)", self.peer_ip, self.downloaded_bytes)
+
 
+class PeerIOLoop:
+    """Drives many peer connections from one thread with a selector"""
+    
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._thread = None
+        self.running = False
+        # Held while handling ready peers, so unregister() returns only once
+        # the peer's messages are no longer being processed (reentrant: a
+        # peer may close itself from the I/O thread)
+        self._dispatch_lock = threading.RLock()
+    
+    def register(self, peer):
+        """Start dispatching incoming data for a connected peer"""
+        peer.running = True
+        peer._io_loop = self
+        self._selector.register(peer.socket, selectors.EVENT_READ, peer)
+    
+    def unregister(self, peer):
+        """Stop dispatching for a peer (safe to call more than once)"""
+        with self._dispatch_lock:
+            peer._io_loop = None
+            try:
+                self._selector.unregister(peer.socket)
+            except (KeyError, ValueError):
+                pass
+    
+    def start(self):
+        """Start the I/O thread"""
+        if not self.running:
+            self.running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        """Wait for readable sockets and hand them to their peers"""
+        while self.running:
+            if not self._selector.get_map():
+                time.sleep(0.1)  # select() fails with no sockets on Windows
+                continue
+            
+            try:
+                events = self._selector.select(timeout=0.5)
+            except (OSError, ValueError):
+                continue  # A peer was closed mid-select
+            
+            with self._dispatch_lock:
+                for key, _ in events:
+                    peer = key.data
+                    if peer._io_loop is not self:
+                        continue  # Unregistered since select() returned
+                    try:
+                        keep = peer.on_readable()
+                    except Exception as e:
+                        # One misbehaving peer must not kill the shared thread
+                        log.warning("Error handling data from %s: %s", peer.peer_ip, e)
+                        keep = False
+                    if not keep:
+                        peer.close()
+    
+    def stop(self):
+        """Stop the I/O thread and close remaining peers"""
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+        for key in list(self._selector.get_map().values()):
+            key.data.close()
+        self._selector.close()
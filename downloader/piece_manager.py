@@ -3,111 +3,418 @@ Piece and Block Management
 Handles piece downloading, verification, and assembly
 """
 
+import errno
 import hashlib
+import logging
+import mmap
 import os
 import threading
+import time
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+# hashlib uses OpenSSL's SHA-1 (SHA-NI accelerated on modern x86) when
+# Python is built against it; the builtin fallback is several times slower
+if hashlib.sha1.__name__ != 'openssl_sha1':
+    log.warning("hashlib is not backed by OpenSSL; piece verification will be slow")
 
 
 class PieceManager:
     """Manages torrent pieces and blocks"""
     
     BLOCK_SIZE = 16384  # 16KB blocks
+    NUM_LOCK_SHARDS = 16  # Power of two, see _lock_for()
+    REQUEST_TIMEOUT = 30  # Seconds before an unanswered block is requested again
+    REQUEUE_INTERVAL = 1.0  # Minimum seconds between scans for missing blocks
+    ENDGAME_FRACTION = 0.05  # Allow duplicate requests when this few blocks remain
     
-    def __init__(self, torrent_info, save_path):
+    def __init__(self, torrent_info, save_path, preallocate=True):
         self.torrent_info = torrent_info
         self.save_path = save_path
+        self.preallocate = preallocate
         
         self.num_pieces = torrent_info['num_pieces']
         self.piece_length = torrent_info['piece_length']
         self.total_size = torrent_info['total_size']
-        self.pieces_hash = torrent_info['pieces_hash']
+        # Concatenated 20-byte SHA1 piece hashes, sliced without copying
+        self.pieces_hash = memoryview(torrent_info['pieces_hash'])
+        
+        # Track piece status ('blocks' holds the indices received so far)
+        self.pieces = [{'downloaded': False, 'blocks': set()} for _ in range(self.num_pieces)]
+        self._downloaded_count = 0
+        
+        # Block bookkeeping is guarded per shard of pieces, request
+        # dispatch by its own lock, so peers rarely contend
+        self._locks = [threading.Lock() for _ in range(self.NUM_LOCK_SHARDS)]
+        self._queue_lock = threading.Lock()
+        
+        # In-flight pieces: preallocated piece buffer, count of missing blocks,
+        # running SHA-1 and the first block not yet fed to it
+        self.piece_buffers = {}
+        self.blocks_remaining = {}
+        self._piece_hashers = {}
+        self._next_block_to_hash = {}
+        
+        # Pieces with blocks left to hand out, and the next block of each
+        self._queue = deque(range(self.num_pieces))
+        self._next_block = {}
         
-        # Track piece status
-        self.pieces = [{'downloaded': False, 'blocks': {}} for _ in range(self.num_pieces)]
-        self.pieces_lock = threading.Lock()
+        # (piece_index, block_index) -> time requested, for blocks not yet received
+        self._inflight = {}
+        self._last_requeue = 0.0
+        self._endgame = False
+        self._total_blocks = sum(self._get_num_blocks(i) for i in range(self.num_pieces))
         
-        # File handle for writing
+        # File descriptor for writing
         self.file_path = os.path.join(save_path, torrent_info['name'])
-        self.file_handle = None
+        self.fd = None
+        self._mm = None
+        self._write_lock = threading.Lock()  # Only used without os.pwrite
+        
+        # Bitfield of pieces written to the file, persisted next to it so a
+        # restarted download only re-verifies pieces that were ever written
+        self.state_path = self.file_path + '.state'
+        self._piece_written = None
+        self._state_fd = None
+        self._state_lock = threading.Lock()
         self._prepare_file()
     
     def _prepare_file(self):
         """Prepare output file"""
         os.makedirs(os.path.dirname(self.file_path) if os.path.dirname(self.file_path) else self.save_path, exist_ok=True)
-        self.file_handle = open(self.file_path, 'wb')
-        # Pre-allocate file
-        self.file_handle.seek(self.total_size - 1)
-        self.file_handle.write(b'\x00')
-        self.file_handle.flush()
+        self._piece_written = self._load_state()
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if not any(self._piece_written):
+            flags |= os.O_TRUNC  # Nothing to resume
+        self.fd = os.open(self.file_path, flags, 0o644)
+        self._preallocate()
+        self._map_file()
+        self._verify_written_pieces()
+        self._open_state()
+    
+    def _load_state(self):
+        """Load the written-pieces bitfield of a previous run, if it matches"""
+        size = (self.num_pieces + 7) // 8
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = bytearray(f.read())
+        except OSError:
+            return bytearray(size)
+        
+        if len(state) != size or not os.path.exists(self.file_path):
+            return bytearray(size)
+        return state
+    
+    def _open_state(self):
+        """Open the state file and write the current bitfield to it"""
+        flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+        self._state_fd = os.open(self.state_path, flags, 0o644)
+        os.write(self._state_fd, self._piece_written)
+    
+    def _is_written(self, piece_index):
+        """Check a piece's bit in the written-pieces bitfield"""
+        return self._piece_written[piece_index >> 3] & (0x80 >> (piece_index & 7))
+    
+    def _mark_written(self, piece_index):
+        """Set a piece's bit and persist its byte
+        
+        Guarded by its own lock: pieces share bitfield bytes, and the disk
+        write must not hold up request dispatch under _queue_lock.
+        """
+        byte_index = piece_index >> 3
+        with self._state_lock:
+            self._piece_written[byte_index] |= 0x80 >> (piece_index & 7)
+            state_byte = self._piece_written[byte_index:byte_index + 1]
+            if hasattr(os, 'pwrite'):
+                os.pwrite(self._state_fd, state_byte, byte_index)
+            else:
+                os.lseek(self._state_fd, byte_index, os.SEEK_SET)
+                os.write(self._state_fd, state_byte)
+    
+    def _verify_written_pieces(self):
+        """Mark pieces already on disk from a previous run as downloaded
+        
+        Only pieces whose bit is set are hashed; the rest are still blank
+        from preallocation and go straight to the request queue.
+        """
+        resumed = 0
+        for piece_index in range(self.num_pieces):
+            if not self._is_written(piece_index):
+                continue
+            
+            offset = piece_index * self.piece_length
+            piece_data = self._read_at(offset, self._get_piece_size(piece_index))
+            expected_hash = self.pieces_hash[piece_index * 20:(piece_index + 1) * 20]
+            if hashlib.sha1(piece_data, usedforsecurity=False).digest() == expected_hash:
+                self.pieces[piece_index]['downloaded'] = True
+                resumed += 1
+            else:
+                # Written but not flushed before a crash
+                self._piece_written[piece_index >> 3] &= ~(0x80 >> (piece_index & 7))
+        
+        self._downloaded_count = resumed
+        if resumed:
+            log.info("Resuming %s with %d/%d pieces", self.file_path, resumed, self.num_pieces)
+    
+    def _preallocate(self):
+        """Size the file, reserving disk space for all of it if preallocating
+        
+        Without preallocation the file is sparse and blocks are allocated
+        as pieces land, which fragments it and defers ENOSPC to mid-download.
+        """
+        if not self.preallocate:
+            os.ftruncate(self.fd, self.total_size)
+            return
+        try:
+            # Allocates real extents and reports ENOSPC before downloading
+            os.posix_fallocate(self.fd, 0, self.total_size)
+            return
+        except AttributeError:
+            pass  # Not available on Windows/macOS
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+            # Filesystem doesn't support fallocate
+        os.ftruncate(self.fd, self.total_size)
+    
+    def _map_file(self):
+        """Map the output file so pieces are written with a plain memcpy"""
+        try:
+            self._mm = mmap.mmap(self.fd, self.total_size, access=mmap.ACCESS_WRITE)
+        except (OSError, ValueError, OverflowError) as e:
+            # Empty file, or too large for the address space (32-bit)
+            log.info("Not memory-mapping %s (%s), using pwrite", self.file_path, e)
+            self._mm = None
+    
+    def _read_at(self, offset, size):
+        """Read size bytes at offset"""
+        if self._mm is not None:
+            return self._mm[offset:offset + size]
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, size, offset)
+        with self._write_lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, size)
+    
+    def _write_at(self, offset, data):
+        """Write data at offset without moving a shared file position"""
+        if self._mm is not None:
+            self._mm[offset:offset + len(data)] = data
+            return
+        
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            # Windows has no pwrite; serialize seek+write instead
+            with self._write_lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while view:
+                    written = os.write(self.fd, view)
+                    view = view[written:]
     
     def get_next_request(self):
-        """Get next block to request from peers"""
-        with self.pieces_lock:
-            for piece_index, piece in enumerate(self.pieces):
-                if piece['downloaded']:
-                    continue
+        """Get next block to request from peers
+
+        A block is handed out once and then tracked as in flight until it
+        arrives. Blocks unanswered for REQUEST_TIMEOUT are handed out again,
+        and in endgame (few blocks left) in-flight blocks may be requested
+        from several peers.
+
+        Block sets are read without their shard lock; a block that arrives
+        concurrently may be handed out once more and is dropped as a
+        duplicate in add_block.
+        """
+        now = time.monotonic()
+        with self._queue_lock:
+            if not self._queue and now - self._last_requeue >= self.REQUEUE_INTERVAL:
+                self._last_requeue = now
+                self._requeue_missing(now)
+            
+            while self._queue:
+                piece_index = self._queue[0]
+                piece = self.pieces[piece_index]
+                num_blocks = self._get_num_blocks(piece_index)
                 
-                # Find missing blocks in this piece
-                piece_size = self._get_piece_size(piece_index)
-                num_blocks = (piece_size + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
+                # Skip blocks that already arrived or are awaited from a peer
+                block_index = self._next_block.get(piece_index, 0)
+                while block_index < num_blocks and (
+                        block_index in piece['blocks']
+                        or self._is_awaited(piece_index, block_index, now)):
+                    block_index += 1
+                
+                if piece['downloaded'] or block_index >= num_blocks:
+                    # Every block of this piece has been handed out
+                    self._queue.popleft()
+                    self._next_block.pop(piece_index, None)
+                    continue
                 
-                for block_index in range(num_blocks):
-                    if block_index not in piece['blocks']:
-                        offset = block_index * self.BLOCK_SIZE
-                        length = min(self.BLOCK_SIZE, piece_size - offset)
-                        return (piece_index, offset, length)
+                self._next_block[piece_index] = block_index + 1
+                self._inflight[(piece_index, block_index)] = now
+                offset = block_index * self.BLOCK_SIZE
+                length = min(self.BLOCK_SIZE, self._get_piece_size(piece_index) - offset)
+                return (piece_index, offset, length)
         
         return None
     
+    def _is_awaited(self, piece_index, block_index, now):
+        """Check if a block was requested recently enough not to request it again"""
+        if self._endgame:
+            return False
+        requested_at = self._inflight.get((piece_index, block_index))
+        return requested_at is not None and now - requested_at < self.REQUEST_TIMEOUT
+    
+    def _requeue_missing(self, now):
+        """Queue pieces with blocks that still need requesting
+        
+        Runs once the queue drains: picks up blocks whose requests timed out
+        (dropping their stale in-flight entries) and switches to endgame
+        when few blocks remain.
+        """
+        stale = [key for key, requested_at in self._inflight.items()
+                 if now - requested_at >= self.REQUEST_TIMEOUT]
+        for key in stale:
+            del self._inflight[key]
+        
+        missing_blocks = 0
+        for piece_index, piece in enumerate(self.pieces):
+            if piece['downloaded']:
+                continue
+            missing = self._get_num_blocks(piece_index) - len(piece['blocks'])
+            missing_blocks += missing
+            if missing:
+                self._next_block[piece_index] = 0
+                self._queue.append(piece_index)
+        
+        self._endgame = missing_blocks <= self._total_blocks * self.ENDGAME_FRACTION
+    
+    def release_requests(self, requests):
+        """Hand back requested blocks a peer will not deliver
+        
+        requests holds (piece_index, offset) pairs from a peer that choked
+        us, disconnected or timed out. Their in-flight entries are dropped
+        and their pieces queued again, so get_next_request hands them to
+        another peer now instead of after REQUEST_TIMEOUT.
+        """
+        with self._queue_lock:
+            for piece_index, offset in requests:
+                block_index = offset // self.BLOCK_SIZE
+                self._inflight.pop((piece_index, block_index), None)
+                
+                next_block = self._next_block.get(piece_index)
+                if next_block is None:
+                    # Every block was handed out; scan the piece again
+                    # (received and awaited blocks are skipped)
+                    self._next_block[piece_index] = 0
+                    self._queue.append(piece_index)
+                elif block_index < next_block:
+                    self._next_block[piece_index] = block_index
+    
     def add_block(self, piece_index, offset, data):
-        """Add downloaded block and assemble pieces"""
-        with self.pieces_lock:
-            if piece_index >= len(self.pieces):
-                return
+        """Add downloaded block and assemble pieces
+
+        data is a view into the peer's receive buffer, which is reused for
+        later messages, so it is copied into the piece buffer before the
+        call returns.
+        """
+        if piece_index >= len(self.pieces):
+            return
+        
+        block_index = offset // self.BLOCK_SIZE
+        with self._queue_lock:
+            self._inflight.pop((piece_index, block_index), None)
+        
+        with self._lock_for(piece_index):
+            piece = self.pieces[piece_index]
+            if piece['downloaded'] or block_index in piece['blocks']:
+                return  # Duplicate block
             
-            block_index = offset // self.BLOCK_SIZE
-            self.pieces[piece_index]['blocks'][block_index] = data
+            piece_buffer = self.piece_buffers.get(piece_index)
+            if piece_buffer is None:
+                piece_buffer = bytearray(self._get_piece_size(piece_index))
+                self.piece_buffers[piece_index] = piece_buffer
+                self.blocks_remaining[piece_index] = self._get_num_blocks(piece_index)
+                self._piece_hashers[piece_index] = hashlib.sha1(usedforsecurity=False)
+                self._next_block_to_hash[piece_index] = 0
+            
+            piece_buffer[offset:offset + len(data)] = data
+            piece['blocks'].add(block_index)
+            self.blocks_remaining[piece_index] -= 1
+            self._hash_contiguous_blocks(piece_index)
             
             # Check if piece is complete
-            if self._is_piece_complete(piece_index):
-                self._assemble_piece(piece_index)
+            if not self._is_piece_complete(piece_index):
+                return
+            del self.blocks_remaining[piece_index]
+            del self._next_block_to_hash[piece_index]
+            piece_data = self.piece_buffers.pop(piece_index)
+            piece_hash = self._piece_hashers.pop(piece_index).digest()
+        
+        # Write outside the lock; the piece's block set is full, so no
+        # other thread will request or accept blocks for it meanwhile
+        self._assemble_piece(piece_index, piece_data, piece_hash)
+    
+    def _hash_contiguous_blocks(self, piece_index):
+        """Feed blocks that now follow the hashed prefix into the piece's SHA-1
+
+        Blocks usually arrive in order, so hashing is spread across arrivals
+        and the digest is ready as soon as the last block lands. Blocks that
+        arrive early are hashed once the gap before them is filled.
+        """
+        blocks = self.pieces[piece_index]['blocks']
+        block_index = self._next_block_to_hash[piece_index]
+        if block_index not in blocks:
+            return
+        
+        start = block_index * self.BLOCK_SIZE
+        while block_index in blocks:
+            block_index += 1
+        end = min(block_index * self.BLOCK_SIZE, self._get_piece_size(piece_index))
+        
+        piece_view = memoryview(self.piece_buffers[piece_index])
+        self._piece_hashers[piece_index].update(piece_view[start:end])
+        self._next_block_to_hash[piece_index] = block_index
     
     def _is_piece_complete(self, piece_index):
         """Check if all blocks of a piece are downloaded"""
-        piece_size = self._get_piece_size(piece_index)
-        num_blocks = (piece_size + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
-        return len(self.pieces[piece_index]['blocks']) == num_blocks
+        return self.blocks_remaining.get(piece_index) == 0
     
-    def _assemble_piece(self, piece_index):
-        """Assemble and verify piece"""
+    def _assemble_piece(self, piece_index, piece_data, piece_hash):
+        """Verify and write a completed piece"""
         piece = self.pieces[piece_index]
         
-        # Concatenate blocks in order
-        piece_data = b''
-        num_blocks = len(piece['blocks'])
-        for i in range(num_blocks):
-            if i in piece['blocks']:
-                piece_data += piece['blocks'][i]
-        
         # Verify hash
-        piece_hash = hashlib.sha1(piece_data).digest()
-        expected_hash = self.pieces_hash[piece_index]
+        expected_hash = self.pieces_hash[piece_index * 20:(piece_index + 1) * 20]
         
         if piece_hash == expected_hash:
             # Write to file
-            offset = piece_index * self.piece_length
-            self.file_handle.seek(offset)
-            self.file_handle.write(piece_data)
-            self.file_handle.flush()
+            self._write_at(piece_index * self.piece_length, piece_data)
             
-            piece['downloaded'] = True
-            piece['blocks'] = {}  # Free memory
+            with self._lock_for(piece_index):
+                piece['downloaded'] = True
+                piece['blocks'] = set()  # Free memory
+            with self._queue_lock:
+                self._downloaded_count += 1
+            self._mark_written(piece_index)
             
-            print(f"[+] Piece {piece_index}/{self.num_pieces} verified and written")
+            log.debug("Piece %d/%d verified and written", piece_index, self.num_pieces)
         else:
             # Hash mismatch, re-download
-            print(f"[!] Piece {piece_index} hash mismatch, re-downloading")
-            piece['blocks'] = {}
+            log.warning("Piece %d hash mismatch, re-downloading", piece_index)
+            with self._lock_for(piece_index):
+                piece['blocks'] = set()
+            with self._queue_lock:
+                self._next_block[piece_index] = 0
+                self._queue.append(piece_index)
+    
+    def _lock_for(self, piece_index):
+        """Get the lock guarding a piece's blocks"""
+        return self._locks[piece_index & (self.NUM_LOCK_SHARDS - 1)]
     
     def _get_piece_size(self, piece_index):
         """Get size of a specific piece"""
@@ -116,18 +423,34 @@ class PieceManager:
             return self.total_size - (piece_index * self.piece_length)
         return self.piece_length
     
+    def _get_num_blocks(self, piece_index):
+        """Get number of blocks in a specific piece"""
+        return (self._get_piece_size(piece_index) + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
+    
     def get_progress(self):
         """Calculate download progress"""
-        with self.pieces_lock:
-            downloaded = sum(1 for p in self.pieces if p['downloaded'])
-            return (downloaded / self.num_pieces) * 100 if self.num_pieces > 0 else 0
+        # Lock-free: reading an int is atomic
+        return (self._downloaded_count / self.num_pieces) * 100 if self.num_pieces > 0 else 0
     
     def is_complete(self):
         """Check if download is complete"""
-        with self.pieces_lock:
-            return all(p['downloaded'] for p in self.pieces)
+        return self._downloaded_count == self.num_pieces
     
     def close(self):
-        """Close file handle"""
-        if self.file_handle:
-            self.file_handle.close()
+        """Flush written pieces to disk and close the file
+        
+        The state file is kept for resuming unless the download is complete.
+        """
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm.close()
+            self._mm = None
+        if self.fd is not None:
+            os.fsync(self.fd)
+            os.close(self.fd)
+            self.fd = None
+        if self._state_fd is not None:
+            os.close(self._state_fd)
+            self._state_fd = None
+            if self.is_complete():
+                os.remove(self.state_path)
@@ -4,44 +4,45 @@ Pure solution - no Python DLL dependencies
 Uses aria2c command-line tool for actual downloads
 """
 
+import atexit
 import os
 import subprocess
 import json
 import time
 import threading
-import hashlib
+import requests
+from urllib.parse import parse_qs, urlsplit
 from django.conf import settings
 from django.utils import timezone
+from .metainfo import bdecode, info_hash_from_torrent
 from .models import TorrentTask
 
 
-class TorrentManager:
-    _instance = None
-    _lock = threading.Lock()
+# TorrentTask columns refreshed from aria2 on every monitor tick
+ARIA2_SYNC_FIELDS = [
+    'progress', 'total_size', 'download_speed', 'upload_speed',
+    'status', 'completed_at', 'error_message', 'name',
+]
 
-    def __new__(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super(TorrentManager, cls).__new__(cls)
-                    cls._instance._initialized = False
-        return cls._instance
+
+class _TorrentManagerImpl:
+    """Use get_manager(); one instance per process owns the download engine"""
 
     def __init__(self):
-        if self._initialized:
-            return
-        
         self.output_dir = str(settings.TORRENT_SAVE_PATH)
         os.makedirs(self.output_dir, exist_ok=True)
         
         self.aria2_process = None
         self.aria2_secret = os.environ.get('ARIA2_SECRET', 'torrentwebchangeme')
         self.running = False
-
+        
+        # Keep-alive connection shared by all RPC calls
+        self._rpc_session = requests.Session()
         
         self._start_aria2()
         self.start_monitoring()
-        self._initialized = True
+        # Don't leave aria2c running after the Django process exits
+        atexit.register(self._shutdown)
         
         print("[+] TorrentManager initialized with aria2c backend")
 
@@ -78,10 +79,8 @@ class TorrentManager:
             print("[!] Download from: https://github.com/aria2/aria2/releases")
             print("[!] Add to PATH or place in project directory")
 
-    def _aria2_rpc(self, method, params=[]):
+    def _aria2_rpc(self, method, params=[], timeout=None):
         """Call aria2 RPC method"""
-        import requests
-        
         payload = {
             "jsonrpc": "2.0",
             "id": "torrentweb",
@@ -90,12 +89,39 @@ class TorrentManager:
         }
         
         try:
-            response = requests.post("http://localhost:6800/jsonrpc", json=payload)
+            response = self._rpc_session.post("http://localhost:6800/jsonrpc", json=payload, timeout=timeout)
             result = response.json()
             return result.get('result')
         except:
             return None
 
+    def _aria2_multicall(self, calls):
+        """Call several aria2 RPC methods in one round-trip
+        
+        calls is a list of (method, params) tuples. Returns one result per
+        call (None for calls that failed), or None if the request failed.
+        """
+        token = f"token:{self.aria2_secret}"
+        payload = {
+            "jsonrpc": "2.0",
+            "id": "torrentweb",
+            "method": "system.multicall",
+            "params": [[
+                {"methodName": method, "params": [token] + params}
+                for method, params in calls
+            ]]
+        }
+        
+        try:
+            response = self._rpc_session.post("http://localhost:6800/jsonrpc", json=payload)
+            results = response.json().get('result')
+            if results is None:
+                return None
+            # Successful calls are wrapped in a one-element list, faults are dicts
+            return [r[0] if isinstance(r, list) else None for r in results]
+        except:
+            return None
+
     def add_magnet(self, magnet_link):
         """Add magnet link"""
         try:
@@ -104,8 +130,8 @@ class TorrentManager:
             
             if gid:
                 # Extract info hash
-                info_hash = self._extract_hash_from_magnet(magnet_link)
-                name = self._extract_name_from_magnet(magnet_link) or f"Download_{info_hash[:8]}"
+                info_hash, name = self._parse_magnet(magnet_link)
+                name = name or f"Download_{info_hash[:8]}"
                 
                 task = TorrentTask.objects.create(
                     info_hash=info_hash or gid,
@@ -126,20 +152,19 @@ class TorrentManager:
         try:
             # Read and encode torrent file
             with open(torrent_file_path, 'rb') as f:
-                import base64
-                torrent_b64 = base64.b64encode(f.read()).decode()
+                raw_torrent = f.read()
+            import base64
+            torrent_b64 = base64.b64encode(raw_torrent).decode()
             
             # Add to aria2
             gid = self._aria2_rpc("aria2.addTorrent", [torrent_b64])
             
             if gid:
                 # Get torrent info
-                import bencodepy
-                with open(torrent_file_path, 'rb') as f:
-                    torrent_data = bencodepy.decode(f.read())
+                torrent_data = bdecode(raw_torrent)
                 
                 info = torrent_data[b'info']
-                info_hash = hashlib.sha1(bencodepy.encode(info)).hexdigest()
+                info_hash = info_hash_from_torrent(raw_torrent)
                 name = info.get(b'name', b'Unknown').decode('utf-8', errors='ignore')
                 
                 task = TorrentTask.objects.create(
@@ -166,71 +191,80 @@ class TorrentManager:
         """Update download status"""
         while self.running:
             try:
-                # Get all active downloads from aria2
-                active = self._aria2_rpc("aria2.tellActive")
-                
-                if active:
-                    for download in active:
-                        self._update_task_from_aria2(download)
+                # Get active and completed downloads in one request
+                results = self._aria2_multicall([
+                    ("aria2.tellActive", []),
+                    ("aria2.tellStopped", [0, 100]),
+                ])
                 
-                # Check completed downloads
-                stopped = self._aria2_rpc("aria2.tellStopped", [0, 100])
-                if stopped:
-                    for download in stopped:
-                        self._update_task_from_aria2(download)
+                self._update_tasks_from_aria2(
+                    [download for downloads in results or [] for download in downloads or []]
+                )
                         
             except Exception as e:
                 print(f"[!] Monitor error: {e}")
             
             time.sleep(2)
 
-    def _update_task_from_aria2(self, download):
-        """Update task from aria2 download info"""
+    def _update_tasks_from_aria2(self, downloads):
+        """Update tasks from aria2 download info with one query and one bulk write"""
         try:
-            info_hash = download.get('infoHash', '')
-            
-            if not info_hash:
-                return
-            
-            task = TorrentTask.objects.filter(info_hash=info_hash).first()
-            if not task:
+            downloads_by_hash = {d['infoHash']: d for d in downloads if d.get('infoHash')}
+            if not downloads_by_hash:
                 return
             
-            # Update progress
-            total = int(download.get('totalLength', 0))
-            completed = int(download.get('completedLength', 0))
-            
-            if total > 0:
-                task.progress = (completed / total) * 100
-                task.total_size = total
+            changed = {}  # task -> names of fields that changed
+            for task in TorrentTask.objects.filter(info_hash__in=downloads_by_hash):
+                before = {field: getattr(task, field) for field in ARIA2_SYNC_FIELDS}
+                self._apply_aria2_download(task, downloads_by_hash[task.info_hash])
+                fields = [field for field in ARIA2_SYNC_FIELDS if getattr(task, field) != before[field]]
+                if fields:
+                    changed[task] = fields
             
-            # Update speeds
-            task.download_speed = int(download.get('downloadSpeed', 0))
-            task.upload_speed = int(download.get('uploadSpeed', 0))
+            # Only write the columns that changed
+            if len(changed) == 1:
+                [(task, fields)] = changed.items()
+                task.save(update_fields=fields)
+            elif changed:
+                fields = [f for f in ARIA2_SYNC_FIELDS if any(f in fs for fs in changed.values())]
+                TorrentTask.objects.bulk_update(list(changed), fields)
             
-            # Update status
-            status = download.get('status', 'active')
-            if status == 'complete':
+        except Exception as e:
+            print(f"[!] Error updating tasks: {e}")
+
+    def _apply_aria2_download(self, task, download):
+        """Copy aria2 download info onto task (not saved)"""
+        # Update progress
+        total = int(download.get('totalLength', 0))
+        completed = int(download.get('completedLength', 0))
+        
+        if total > 0:
+            task.progress = (completed / total) * 100
+            task.total_size = total
+        
+        # Update speeds
+        task.download_speed = int(download.get('downloadSpeed', 0))
+        task.upload_speed = int(download.get('uploadSpeed', 0))
+        
+        # Update status
+        status = download.get('status', 'active')
+        if status == 'complete':
+            if task.status != 'completed':
                 task.status = 'completed'
                 task.completed_at = timezone.now()
-            elif status == 'paused':
-                task.status = 'paused'
-            elif status == 'error':
-                task.status = 'error'
-                task.error_message = download.get('errorMessage', 'Unknown error')
-            else:
-                task.status = 'downloading'
-            
-            # Update name if not set
-            if task.name.startswith('Download_'):
-                bittorrent = download.get('bittorrent', {})
-                if bittorrent and 'info' in bittorrent:
-                    task.name = bittorrent['info'].get('name', task.name)
-            
-            task.save()
-            
-        except Exception as e:
-            print(f"[!] Error updating task: {e}")
+        elif status == 'paused':
+            task.status = 'paused'
+        elif status == 'error':
+            task.status = 'error'
+            task.error_message = download.get('errorMessage', 'Unknown error')
+        else:
+            task.status = 'downloading'
+        
+        # Update name if not set
+        if task.name.startswith('Download_'):
+            bittorrent = download.get('bittorrent', {})
+            if bittorrent and 'info' in bittorrent:
+                task.name = bittorrent['info'].get('name', task.name)
 
     def pause_torrent(self, info_hash):
         """Pause download"""
@@ -262,28 +296,58 @@ class TorrentManager:
         except:
             pass
 
-    def _extract_hash_from_magnet(self, magnet_link):
+    def _parse_magnet(self, magnet_link):
+        """Extract (info_hash, name) from a magnet link in one pass"""
         try:
-            parts = magnet_link.split('&')
-            for part in parts:
-                if 'xt=urn:btih:' in part:
-                    return part.split('xt=urn:btih:')[1].split('&')[0].lower()
-        except:
-            pass
-        return None
+            params = parse_qs(urlsplit(magnet_link).query)
+        except ValueError:
+            return None, None
+        
+        info_hash = None
+        for xt in params.get('xt', []):
+            if xt.startswith('urn:btih:'):
+                info_hash = xt[len('urn:btih:'):].lower()
+                break
+        
+        # parse_qs already percent-decodes values
+        name = params.get('dn', [None])[0]
+        return info_hash, name
+
+    def _shutdown(self):
+        """Stop monitoring and shut aria2c down (safe to call more than once)"""
+        self.running = False
+        
+        if self.aria2_process and self.aria2_process.poll() is None:
+            # Ask aria2c to exit cleanly, then make sure it is gone
+            self._aria2_rpc("aria2.shutdown", timeout=2)
+            try:
+                self.aria2_process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.aria2_process.terminate()
+                try:
+                    self.aria2_process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.aria2_process.kill()
+        
+        self._rpc_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._shutdown()
+
+
+_manager = None
+_manager_lock = threading.Lock()
 
-    def _extract_name_from_magnet(self, magnet_link):
-        from urllib.parse import unquote
-        try:
-            parts = magnet_link.split('&')
-            for part in parts:
-                if 'dn=' in part:
-                    return unquote(part.split('dn=')[1].split('&')[0])
-        except:
-            pass
-        return None
 
-    def __del__(self):
-        """Cleanup"""
-        if self.aria2_process:
-            self.aria2_process.terminate()
+def get_manager():
+    """Return the process-wide torrent manager, creating it on first use"""
+    global _manager
+    if _manager is None:
+        # Only the first calls take the lock; two managers would mean two engines
+        with _manager_lock:
+            if _manager is None:
+                _manager = _TorrentManagerImpl()
+    return _manager
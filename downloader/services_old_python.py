@@ -4,59 +4,137 @@ PRODUCTION-READY Pure-Python BitTorrent Client
 - Piece-based downloading with SHA1 verification  
 - Multi-peer connections
 - Actual file assembly and writing to disk
+
+Not used by the views: downloads go through the aria2c-backed
+manager in services.py, whose native engine does the wire
+protocol and hashing. This module is kept as a dependency-free
+fallback and reference implementation.
 """
 
+import atexit
+import base64
+import contextlib
+import logging
 import os
 import time
 import threading
 import requests
 import hashlib
-import bencodepy
+import socket
 import struct
 import random
-from urllib.parse import unquote, urlencode
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from functools import lru_cache
+from urllib.parse import parse_qs, urlencode, urlsplit
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 from django.utils import timezone
+from .metainfo import bdecode, info_hash_from_torrent
 from .models import TorrentTask
-from .peer_protocol import PeerConnection
+from .peer_protocol import PeerConnection, PeerIOLoop
 from .piece_manager import PieceManager
+from . import udp_tracker
+
+
+log = logging.getLogger(__name__)
+
+# Tracker announces: per-request timeout (also the overall wait) and the
+# peer count at which we stop waiting for slower trackers
+ANNOUNCE_TIMEOUT = 5
+ENOUGH_PEERS = 30
+
+# Shared HTTP session so repeat announces reuse tracker connections
+_tracker_session = requests.Session()
+_tracker_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+_tracker_session.mount('http://', _tracker_adapter)
+_tracker_session.mount('https://', _tracker_adapter)
 
+# Peers connected per torrent, and handshakes attempted at once
+MAX_PEERS = 50
+CONNECT_WORKERS = 16
 
-class TorrentManager:
-    _instance = None
-    _lock = threading.Lock()
+# Compact peer entry: 4-byte IPv4 address + 2-byte port
+_COMPACT_PEER = struct.Struct('>4sH')
 
-    def __new__(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super(TorrentManager, cls).__new__(cls)
-                    cls._instance._initialized = False
-        return cls._instance
+
+def _parse_compact_peers(peers_data):
+    """Parse a compact tracker peer list into (ip, port) tuples"""
+    # iter_unpack walks the records in C; drop any trailing partial record
+    usable = len(peers_data) - len(peers_data) % _COMPACT_PEER.size
+    return [
+        (socket.inet_ntoa(ip_bytes), port)
+        for ip_bytes, port in _COMPACT_PEER.iter_unpack(memoryview(peers_data)[:usable])
+    ]
+
+
+def _btih_to_hex(btih):
+    """Normalize a magnet btih (40 hex or 32 base32 chars) to lowercase hex"""
+    try:
+        if len(btih) == 32:
+            return base64.b32decode(btih.upper()).hex()
+        if len(btih) == 40:
+            return bytes.fromhex(btih).hex()
+    except ValueError:  # binascii.Error is a ValueError
+        pass
+    return None
+
+
+@lru_cache(maxsize=256)
+def _parse_magnet(magnet_link):
+    """Parse a magnet link in one pass (cached; the result is immutable)"""
+    # parse_qs splits and percent-decodes the whole query string at once
+    params = parse_qs(urlsplit(magnet_link).query)
+    
+    info_hash = None
+    for xt in params.get('xt', []):
+        if xt.startswith('urn:btih:'):
+            info_hash = _btih_to_hex(xt.removeprefix('urn:btih:'))
+            break
+    if not info_hash:
+        info_hash = hashlib.sha1(magnet_link.encode()).hexdigest()
+    
+    name = params.get('dn', [None])[0]
+    return info_hash, name, tuple(params.get('tr', []))
+
+
+class _TorrentManagerImpl:
+    """Use get_manager(); one instance per process owns the download engine"""
 
     def __init__(self):
-        if self._initialized:
-            return
-        
         self.output_dir = str(settings.TORRENT_SAVE_PATH)
         os.makedirs(self.output_dir, exist_ok=True)
         
         self.active_downloads = {}  # info_hash -> download session
         self.running = False
         
+        # info_hash -> TorrentTask fields not yet written (see _flush_task_updates)
+        self._pending_updates = {}
+        self._pending_lock = threading.Lock()
+        
+        # info_hash -> Event; download threads check these instead of
+        # re-reading the task's status from the database every iteration
+        self._pause_events = {}
+        self._cancel_events = {}
+        # info_hash -> connected peers, so resume can restart their pipelines
+        self._peers = {}
+        
         self.peer_id = self._generate_peer_id()
         
+        # One I/O thread reads from the peers of every torrent
+        self.peer_io = PeerIOLoop()
+        self.peer_io.start()
+        
         self.start_monitoring()
-        self._initialized = True
+        atexit.register(self._flush_task_updates)
         
-        print("[+] PRODUCTION BitTorrent Client initialized")
-        print(f"[+] Peer ID: {self.peer_id.hex()[:16]}...")
+        log.info("Pure-Python BitTorrent client initialized (peer ID %s...)", self.peer_id.hex()[:16])
 
     def add_magnet(self, magnet_link):
         """Add magnet link - fetch metadata then download"""
-        info_hash = self._extract_hash_from_magnet(magnet_link)
-        name = self._extract_name_from_magnet(magnet_link) or f"Download_{info_hash[:8]}"
-        trackers = self._extract_trackers_from_magnet(magnet_link)
+        info_hash, name, trackers = _parse_magnet(magnet_link)
+        name = name or f"Download_{info_hash[:8]}"
+        trackers = list(trackers)
         
         task, created = TorrentTask.objects.get_or_create(
             info_hash=info_hash,
@@ -70,7 +148,8 @@ class TorrentManager:
         
         if created or task.status in ['error', 'paused']:
             task.status = 'downloading'
-            task.save()
+            task.save(update_fields=['status'])
+            self._reset_control_events(info_hash)
             
             # Start metadata fetch + download
             thread = threading.Thread(
@@ -87,10 +166,11 @@ class TorrentManager:
         """Add .torrent file and start downloading"""
         try:
             with open(torrent_file_path, 'rb') as f:
-                torrent_data = bencodepy.decode(f.read())
+                raw_torrent = f.read()
+            torrent_data = bdecode(raw_torrent)
             
             info = torrent_data[b'info']
-            info_hash = hashlib.sha1(bencodepy.encode(info)).hexdigest()
+            info_hash = info_hash_from_torrent(raw_torrent)
             
             # Parse torrent metadata
             torrent_info = self._parse_torrent_info(info)
@@ -118,7 +198,8 @@ class TorrentManager:
                 task.name = torrent_info['name']
                 task.total_size = torrent_info['total_size']
                 task.status = 'downloading'
-                task.save()
+                task.save(update_fields=['name', 'total_size', 'status'])
+                self._reset_control_events(info_hash)
                 
                 # Start download
                 thread = threading.Thread(
@@ -132,9 +213,7 @@ class TorrentManager:
             return task
             
         except Exception as e:
-            print(f"[!] Error parsing torrent: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Error parsing torrent %s: %s", torrent_file_path, e)
             
             task = TorrentTask.objects.create(
                 info_hash=hashlib.sha1(os.urandom(20)).hexdigest(),
@@ -151,8 +230,9 @@ class TorrentManager:
         piece_length = info.get(b'piece length', 262144)
         pieces = info.get(b'pieces', b'')
         
-        # Split pieces into 20-byte SHA1 hashes
-        pieces_hash = [pieces[i:i+20] for i in range(0, len(pieces), 20)]
+        # Concatenated 20-byte SHA1 hashes, kept as one buffer (PieceManager
+        # slices out the hash it needs instead of holding one object per piece)
+        pieces_hash = pieces
         
         # Calculate total size
         total_size = 0
@@ -166,102 +246,91 @@ class TorrentManager:
             'name': name,
             'piece_length': piece_length,
             'pieces_hash': pieces_hash,
-            'num_pieces': len(pieces_hash),
+            'num_pieces': len(pieces_hash) // 20,
             'total_size': total_size
         }
 
     def _download_from_magnet(self, task, info_hash, trackers):
         """Download from magnet - need to fetch metadata first"""
-        print(f"[+] Fetching metadata for magnet: {task.name}")
+        log.info("Fetching metadata for magnet: %s", task.name)
         
         # For magnets, we need DHT or metadata exchange
         # Simplified: use tracker to get peers, then request metadata
         peers = self._get_peers_from_trackers(info_hash, trackers)
         
         if not peers:
-            print(f"[!] No peers found for {task.name}")
+            log.warning("No peers found for %s", task.name)
             task.status = 'error'
             task.error_message = 'No peers available'
-            task.save()
+            task.save(update_fields=['status', 'error_message'])
             return
         
         # For now, simulate with demo progress
         # Full implementation would fetch metadata from peers
-        print(f"[!] Magnet metadata fetch not fully implemented")
-        print(f"[!] Use .torrent files for full functionality")
+        log.warning("Magnet metadata fetch not fully implemented; use .torrent files for full functionality")
         self._demo_download(task)
 
     def _download_torrent(self, task, info_hash, torrent_info, trackers):
         """Main download orchestration with peer connections"""
+        # Taken up front so a removal during peer setup is still seen
+        paused, cancelled = self._control_events(info_hash)
+        piece_manager = None
+        peer_connections = []
         try:
-            print(f"[+] Starting download: {task.name}")
-            print(f"[+] Size: {torrent_info['total_size']} bytes")
-            print(f"[+] Pieces: {torrent_info['num_pieces']}")
+            log.info("Starting download: %s (%d bytes, %d pieces)",
+                     task.name, torrent_info['total_size'], torrent_info['num_pieces'])
             
-            # Initialize piece manager
-            piece_manager = PieceManager(torrent_info, self.output_dir)
+            # Initialize piece manager (file is preallocated and mmapped)
+            piece_manager = PieceManager(torrent_info, self.output_dir, preallocate=True)
             
             # Get peers from trackers
             peers = self._get_peers_from_trackers(info_hash, trackers)
             
             if not peers:
-                print(f"[!] No peers found, using demo mode")
+                log.warning("No peers found for %s, using demo mode", task.name)
                 self._demo_download(task)
                 return
             
-            print(f"[+] Found {len(peers)} peers")
+            log.info("Found %d peers for %s", len(peers), task.name)
             
             # Connect to peers and download
-            peer_connections = []
-            max_peers = min(5, len(peers))  # Connect to up to 5 peers
-            
-            for peer_ip, peer_port in peers[:max_peers]:
-                peer = PeerConnection(peer_ip, peer_port, info_hash, self.peer_id, piece_manager)
-                if peer.connect():
-                    peer_connections.append(peer)
-                    # Send interested message immediately
-                    peer.send_interested()
-                    # Start message handler in separate thread
-                    threading.Thread(target=peer.handle_messages, daemon=True).start()
+            unchoked = threading.Event()
+            peer_connections = self._connect_peers(peers[:MAX_PEERS], info_hash, piece_manager, unchoked, paused)
+            self._peers[info_hash] = peer_connections
             
             if not peer_connections:
-                print(f"[!] Could not connect to any peers")
+                log.warning("Could not connect to any peers for %s", task.name)
                 self._demo_download(task)
                 return
             
-            print(f"[+] Connected to {len(peer_connections)} peers, waiting for unchoke...")
+            log.info("Connected to %d peers, waiting for unchoke...", len(peer_connections))
             
-            # Wait a bit for peers to send bitfield and unchoke us
-            time.sleep(2)
+            # Start requesting as soon as any peer unchokes us
+            unchoked.wait(timeout=2)
             
             # Download pieces
             start_time = time.time()
             last_progress = 0
             stalled_count = 0
+            last_flushed_progress = 0
+            last_flush = start_time
             
             while not piece_manager.is_complete():
-                # Check if task was paused
-                task.refresh_from_db()
-                if task.status == 'paused':
-                    time.sleep(1)
+                if cancelled.is_set():
+                    break
+                
+                # Check if task was paused (wakes early if it is removed)
+                if paused.is_set():
+                    cancelled.wait(timeout=1)
                     continue
                 
-                # Request blocks from ALL connected peers
-                requests_sent = 0
-                for peer in peer_connections:
-                    if peer.connected and not peer.peer_choking:
-                        # Request up to 10 blocks per peer per cycle
-                        for _ in range(10):
-                            request = piece_manager.get_next_request()
-                            if request:
-                                piece_index, offset, length = request
-                                peer.send_request(piece_index, offset, length)
-                                requests_sent += 1
-                            else:
-                                break  # No more blocks to request
+                # Peers refill their request pipelines from the I/O thread as
+                # blocks arrive; topping up here covers blocks handed out
+                # again after a timeout while a peer's pipeline was idle
+                requests_sent = sum(peer.fill_pipeline() for peer in peer_connections)
                 
                 if requests_sent > 0:
-                    print(f"[+] Sent {requests_sent} block requests")
+                    log.debug("Sent %d block requests", requests_sent)
                 
                 # Update progress
                 progress = piece_manager.get_progress()
@@ -270,10 +339,12 @@ class TorrentManager:
                 #  Check for stalling
                 if progress == last_progress:
                     stalled_count += 1
-                    if stalled_count > 20:  # 10 seconds with no progress
-                        print(f"[!] Download appears stalled at {progress:.1f}%")
-                        print(f"[!] Active peers: {sum(1 for p in peer_connections if p.connected)}")
-                        print(f"[!] Unchoked peers: {sum(1 for p in peer_connections if p.connected and not p.peer_choking)}")
+                    # After 10 seconds with no progress, then every 10 seconds
+                    if stalled_count % 20 == 0:
+                        log.warning("Download appears stalled at %.1f%% (%d active peers, %d unchoked)",
+                                    progress,
+                                    sum(1 for p in peer_connections if p.connected),
+                                    sum(1 for p in peer_connections if p.connected and not p.peer_choking))
                 else:
                     stalled_count = 0
                 last_progress = progress
@@ -288,96 +359,155 @@ class TorrentManager:
                         remaining = task.total_size - downloaded
                         task.eta = int(remaining / task.download_speed)
                 
-                task.save()
+                # Coalesce progress writes: flush on a 0.5% move or every 2 s
+                self._queue_task_update(
+                    info_hash,
+                    progress=task.progress,
+                    download_speed=task.download_speed,
+                    eta=task.eta,
+                )
+                now = time.time()
+                if abs(progress - last_flushed_progress) >= 0.5 or now - last_flush > 2.0:
+                    self._flush_task_updates(info_hash)
+                    last_flushed_progress = progress
+                    last_flush = now
+                
                 time.sleep(0.5)
 
             
+            if cancelled.is_set():
+                # Removed while downloading: the task row is gone
+                log.info("Download cancelled: %s", task.name)
+                self._discard_task_updates(info_hash)
+                return
+            
             # Download complete
-            piece_manager.close()
+            self._discard_task_updates(info_hash)
             task.progress = 100.0
             task.status = 'completed'
             task.completed_at = timezone.now()
-            task.save()
+            task.save(update_fields=['progress', 'status', 'completed_at'])
             
-            print(f"[+] Download completed: {task.name}")
-            
-            # Close peer connections
-            for peer in peer_connections:
-                peer.close()
+            log.info("Download completed: %s", task.name)
             
         except Exception as e:
-            print(f"[!] Download error: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Download error for %s: %s", task.name, e)
+            self._discard_task_updates(info_hash)
             task.status = 'error'
             task.error_message = str(e)
-            task.save()
+            task.save(update_fields=['status', 'error_message'])
+        finally:
+            self._peers.pop(info_hash, None)
+            # Close peer connections (this also drops them from the I/O loop)
+            # before the file, so no block arrives for a closed PieceManager
+            for peer in peer_connections:
+                peer.close()
+            if piece_manager is not None:
+                piece_manager.close()
+
+    def _connect_peers(self, peers, info_hash, piece_manager, unchoke_event, pause_event):
+        """Connect to peers concurrently and register them with the I/O loop"""
+        def connect(address):
+            peer = PeerConnection(address[0], address[1], info_hash, self.peer_id, piece_manager,
+                                  unchoke_event, pause_event)
+            # Interested is sent together with the handshake
+            return peer if peer.connect(interested=True) else None
+        
+        with ThreadPoolExecutor(max_workers=min(CONNECT_WORKERS, len(peers))) as pool:
+            peer_connections = [peer for peer in pool.map(connect, peers) if peer]
+        
+        for peer in peer_connections:
+            self.peer_io.register(peer)
+        return peer_connections
 
     def _get_peers_from_trackers(self, info_hash, trackers):
-        """Announce to trackers and get peer list"""
-        peers = []
+        """Announce to all trackers in parallel and collect their peers"""
+        trackers = list(dict.fromkeys(trackers))  # Dedupe, keep order
+        if not trackers:
+            return []
         
-        for tracker_url in trackers[:3]:  # Try first 3 trackers
-            if not tracker_url.startswith('http'):
-                continue  # Skip UDP trackers for now
-            
-            try:
-                print(f"[+] Announcing to tracker: {tracker_url[:50]}...")
-                
-                params = {
-                    'info_hash': bytes.fromhex(info_hash),
-                    'peer_id': self.peer_id,
-                    'port': 6881,
-                    'uploaded': 0,
-                    'downloaded': 0,
-                    'left': 0,
-                    'compact': 1,
-                    'event': 'started'
-                }
-                
-                response = requests.get(tracker_url, params=params, timeout=10)
-                if response.status_code == 200:
-                    data = bencodepy.decode(response.content)
-                    
-                    if b'peers' in data:
-                        peers_data = data[b'peers']
-                        
-                        if isinstance(peers_data, bytes):
-                            # Compact format: 6 bytes per peer (4 IP + 2 port)
-                            for i in range(0, len(peers_data), 6):
-                                if i + 6 <= len(peers_data):
-                                    ip_bytes = peers_data[i:i+4]
-                                    port_bytes = peers_data[i+4:i+6]
-                                    
-                                    ip = '.'.join(str(b) for b in ip_bytes)
-                                    port = struct.unpack('>H', port_bytes)[0]
-                                    peers.append((ip, port))
-                        
-                        print(f"[+] Got {len(peers)} peers from tracker")
-                        if peers:
-                            break
+        # The hash and the HTTP query are the same for every tracker
+        info_hash_bytes = bytes.fromhex(info_hash)
+        announce_query = urlencode({
+            'info_hash': info_hash_bytes,
+            'peer_id': self.peer_id,
+            'port': 6881,
+            'uploaded': 0,
+            'downloaded': 0,
+            'left': 0,
+            'compact': 1,
+            'event': 'started'
+        })
+        
+        peers = {}  # (ip, port) -> None, an insertion-ordered set
+        pool = ThreadPoolExecutor(max_workers=min(16, len(trackers)))
+        futures = {
+            pool.submit(self._announce_one, tracker_url, info_hash_bytes, announce_query): tracker_url
+            for tracker_url in trackers
+        }
+        
+        try:
+            for future in as_completed(futures, timeout=ANNOUNCE_TIMEOUT):
+                tracker_url = futures[future]
+                try:
+                    tracker_peers = future.result()
+                except Exception as e:
+                    log.debug("Tracker %s failed: %s", tracker_url[:50], e)
+                    continue
                 
-            except Exception as e:
-                print(f"[!] Tracker {tracker_url[:30]}... failed: {e}")
-                continue
+                peers.update(dict.fromkeys(tracker_peers))
+                log.debug("Got %d peers from %s", len(tracker_peers), tracker_url[:50])
+                if len(peers) >= ENOUGH_PEERS:
+                    break
+        except FuturesTimeoutError:
+            log.info("Some trackers did not answer within %ss", ANNOUNCE_TIMEOUT)
+        finally:
+            # Don't wait for slow trackers once we have an answer
+            pool.shutdown(wait=False, cancel_futures=True)
         
-        return peers
+        return list(peers)
+
+    def _announce_one(self, tracker_url, info_hash_bytes, announce_query):
+        """Announce to a single tracker and return its (ip, port) peers"""
+        log.debug("Announcing to tracker: %s", tracker_url[:50])
+        
+        if tracker_url.startswith('udp://'):
+            peers_data = udp_tracker.announce(
+                tracker_url, info_hash_bytes, self.peer_id, timeout=ANNOUNCE_TIMEOUT
+            )
+            return _parse_compact_peers(peers_data)
+        
+        if not tracker_url.startswith(('http://', 'https://')):
+            return []
+        
+        # Some announce URLs already carry a query (e.g. a passkey)
+        separator = '&' if '?' in tracker_url else '?'
+        response = _tracker_session.get(tracker_url + separator + announce_query, timeout=ANNOUNCE_TIMEOUT)
+        if response.status_code != 200:
+            return []
+        
+        data = bdecode(response.content)
+        peers_data = data.get(b'peers')
+        if isinstance(peers_data, bytes):
+            return _parse_compact_peers(peers_data)
+        return []
 
     def _demo_download(self, task):
         """Demo mode when peers unavailable"""
-        print(f"[!] Running in demo mode for: {task.name}")
-        import random
+        log.warning("Running in demo mode for: %s", task.name)
+        paused, cancelled = self._control_events(task.info_hash)
+        rng = random.Random(task.info_hash)  # Same fake curve for a torrent
+        update_fields = ['progress', 'download_speed', 'upload_speed', 'eta']
         
-        while task.progress < 100:
+        while task.progress < 100 and not cancelled.is_set():
             try:
-                task.refresh_from_db()
-                if task.status == 'paused':
-                    time.sleep(1)
+                if paused.is_set():
+                    cancelled.wait(timeout=1)
                     continue
                 
-                task.progress = min(100.0, task.progress + random.uniform(1.0, 3.0))
-                task.download_speed = random.randint(500000, 5000000)
-                task.upload_speed = random.randint(10000, 100000)
+                task.progress = min(100.0, task.progress + rng.uniform(1.0, 3.0))
+                task.download_speed = rng.randint(500000, 5000000)
+                task.upload_speed = rng.randint(10000, 100000)
                 
                 if task.total_size > 0:
                     remaining = (100 - task.progress) / 100 * task.total_size
@@ -386,9 +516,10 @@ class TorrentManager:
                 if task.progress >= 100:
                     task.status = 'completed'
                     task.completed_at = timezone.now()
+                    update_fields += ['status', 'completed_at']
                 
-                task.save()
-                time.sleep(1)
+                task.save(update_fields=update_fields)
+                cancelled.wait(timeout=1)
             except:
                 break
 
@@ -399,25 +530,71 @@ class TorrentManager:
 
     def _monitor_loop(self):
         while self.running:
-            time.sleep(5)
+            time.sleep(2)
+            try:
+                self._flush_task_updates()
+            except Exception as e:
+                log.warning("Error flushing task updates: %s", e)
+
+    def _queue_task_update(self, info_hash, **fields):
+        """Record task fields to write on the next flush"""
+        with self._pending_lock:
+            self._pending_updates.setdefault(info_hash, {}).update(fields)
+
+    def _discard_task_updates(self, info_hash):
+        """Drop pending fields for a task that is about to be saved directly"""
+        with self._pending_lock:
+            self._pending_updates.pop(info_hash, None)
+
+    def _flush_task_updates(self, info_hash=None):
+        """Write pending task fields (one UPDATE per task, only those columns)"""
+        # Writes happen under the lock so an older snapshot can't land last
+        with self._pending_lock:
+            if info_hash is None:
+                pending, self._pending_updates = self._pending_updates, {}
+            else:
+                fields = self._pending_updates.pop(info_hash, None)
+                pending = {info_hash: fields} if fields else {}
+            
+            for pending_hash, fields in pending.items():
+                TorrentTask.objects.filter(info_hash=pending_hash).update(**fields)
+
+    def _control_events(self, info_hash):
+        """Get the (paused, cancelled) events of a torrent"""
+        paused = self._pause_events.setdefault(info_hash, threading.Event())
+        cancelled = self._cancel_events.setdefault(info_hash, threading.Event())
+        return paused, cancelled
+
+    def _reset_control_events(self, info_hash):
+        """Clear pause/cancel state before (re)starting a download"""
+        for event in self._control_events(info_hash):
+            event.clear()
 
     def pause_torrent(self, info_hash):
+        self._control_events(info_hash)[0].set()
         try:
             task = TorrentTask.objects.get(info_hash=info_hash)
             task.status = 'paused'
-            task.save()
+            task.save(update_fields=['status'])
         except:
             pass
     
     def resume_torrent(self, info_hash):
+        self._control_events(info_hash)[0].clear()
+        # Peers stopped refilling while paused; restart their pipelines now
+        for peer in self._peers.get(info_hash, ()):
+            peer.fill_pipeline()
         try:
-            task = TorrentTask.objects.get(info_hash=info_hash)
-            task.status = 'downloading'
-            task.save()
+            # A download that finished while paused stays completed
+            TorrentTask.objects.filter(info_hash=info_hash, status='paused').update(status='downloading')
         except:
             pass
 
     def remove_torrent(self, info_hash, delete_files=False):
+        # Stop the download thread before its files are deleted
+        self._cancel_events.pop(info_hash, threading.Event()).set()
+        self._pause_events.pop(info_hash, None)
+        self._discard_task_updates(info_hash)
         try:
             task = TorrentTask.objects.get(info_hash=info_hash)
             
@@ -434,7 +611,12 @@ class TorrentManager:
                         elif os.path.isdir(file_path):
                             shutil.rmtree(file_path)
                     except Exception as e:
-                        print(f"[!] Error deleting files: {e}")
+                        log.warning("Error deleting files for %s: %s", info_hash, e)
+                # Resume state left by PieceManager. Best effort: the download
+                # thread may still hold it open (Windows refuses the delete),
+                # and that must not stop the task row from being deleted
+                with contextlib.suppress(OSError):
+                    os.remove(file_path + '.state')
             
             task.delete()
         except:
@@ -445,34 +627,17 @@ class TorrentManager:
         """Generate BitTorrent peer ID"""
         return b'-PY0100-' + bytes([random.randint(0, 255) for _ in range(12)])
 
-    def _extract_hash_from_magnet(self, magnet_link):
-        try:
-            parts = magnet_link.split('&')
-            for part in parts:
-                if 'xt=urn:btih:' in part:
-                    return part.split('xt=urn:btih:')[1].split('&')[0].lower()
-        except:
-            pass
-        return hashlib.sha1(magnet_link.encode()).hexdigest()
 
-    def _extract_name_from_magnet(self, magnet_link):
-        try:
-            parts = magnet_link.split('&')
-            for part in parts:
-                if 'dn=' in part:
-                    return unquote(part.split('dn=')[1].split('&')[0])
-        except:
-            pass
-        return None
+_manager = None
+_manager_lock = threading.Lock()
 
-    def _extract_trackers_from_magnet(self, magnet_link):
-        trackers = []
-        try:
-            parts = magnet_link.split('&')
-            for part in parts:
-                if 'tr=' in part:
-                    tracker = unquote(part.split('tr=')[1].split('&')[0])
-                    trackers.append(tracker)
-        except:
-            pass
-        return trackers
+
+def get_manager():
+    """Return the process-wide torrent manager, creating it on first use"""
+    global _manager
+    if _manager is None:
+        # Only the first calls take the lock; two managers would mean two engines
+        with _manager_lock:
+            if _manager is None:
+                _manager = _TorrentManagerImpl()
+    return _manager
@@ -1,3 +1,531 @@
-from django.test import TestCase
+import hashlib
+import os
+import select
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from . import udp_tracker
+from .metainfo import info_hash_from_torrent
+from .peer_protocol import PeerConnection, PeerIOLoop
+from .piece_manager import PieceManager
+from .services_old_python import _parse_compact_peers, _parse_magnet
+
+
+def bencode(value):
+    """Minimal bencoder for building test torrents (dict keys kept in order)"""
+    if isinstance(value, int):
+        return b'i%de' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'%d:%s' % (len(value), value)
+    if isinstance(value, list):
+        return b'l' + b''.join(bencode(item) for item in value) + b'e'
+    return b'd' + b''.join(bencode(k) + bencode(v) for k, v in value.items()) + b'e'
+
+
+INFO = {
+    'length': 40000,
+    'name': 'file.bin',
+    'piece length': 16384,
+    'pieces': b'\x01' * 60,
+}
+
+
+class InfoHashTests(SimpleTestCase):
+    def test_matches_sha1_of_info(self):
+        torrent = bencode({'announce': 'http://tracker/announce', 'info': INFO})
+        expected = hashlib.sha1(bencode(INFO)).hexdigest()
+        self.assertEqual(info_hash_from_torrent(torrent), expected)
+
+    def test_keys_after_info(self):
+        torrent = bencode({
+            'announce': 'http://tracker/announce',
+            'info': INFO,
+            'url-list': ['http://mirror/file.bin'],
+        })
+        expected = hashlib.sha1(bencode(INFO)).hexdigest()
+        self.assertEqual(info_hash_from_torrent(torrent), expected)
+
+    def test_nested_info_values(self):
+        info = {
+            'files': [{'length': 1, 'path': ['a', 'b']}, {'length': 2, 'path': ['c']}],
+            'name': 'dir',
+            'piece length': 16384,
+            'pieces': b'e' * 20,  # String bytes that look like an 'e' terminator
+        }
+        torrent = bencode({'info': info, 'private': 1})
+        expected = hashlib.sha1(bencode(info)).hexdigest()
+        self.assertEqual(info_hash_from_torrent(torrent), expected)
+
+    def test_hashes_raw_bytes_of_non_canonical_info(self):
+        # Keys out of order: re-encoding a decoded dict would sort them
+        info = {'name': 'file.bin', 'length': 1, 'pieces': b'\x00' * 20, 'piece length': 16384}
+        torrent = bencode({'info': info})
+        expected = hashlib.sha1(bencode(info)).hexdigest()
+        self.assertEqual(info_hash_from_torrent(torrent), expected)
+
+    def test_truncated_torrent(self):
+        torrent = bencode({'announce': 'http://tracker/announce', 'info': INFO})
+        with self.assertRaises(ValueError):
+            info_hash_from_torrent(torrent[:len(torrent) // 2])
+
+    def test_missing_info(self):
+        with self.assertRaises(ValueError):
+            info_hash_from_torrent(bencode({'announce': 'http://tracker/announce'}))
+
+    def test_not_a_dictionary(self):
+        with self.assertRaises(ValueError):
+            info_hash_from_torrent(bencode(['info']))
+
+
+class CompactPeerTests(SimpleTestCase):
+    def test_parse(self):
+        data = socket.inet_aton('1.2.3.4') + struct.pack('>H', 6881)
+        data += socket.inet_aton('10.0.0.255') + struct.pack('>H', 80)
+        self.assertEqual(_parse_compact_peers(data), [('1.2.3.4', 6881), ('10.0.0.255', 80)])
+
+    def test_ignores_trailing_partial_entry(self):
+        data = socket.inet_aton('1.2.3.4') + struct.pack('>H', 6881) + b'\x05\x06'
+        self.assertEqual(_parse_compact_peers(data), [('1.2.3.4', 6881)])
+
+    def test_empty(self):
+        self.assertEqual(_parse_compact_peers(b''), [])
+
+
+class MagnetTests(SimpleTestCase):
+    def test_parse(self):
+        info_hash, name, trackers = _parse_magnet(
+            'magnet:?xt=urn:btih:ABCDEF0123456789ABCDEF0123456789ABCDEF01'
+            '&dn=Some%20File&tr=udp%3A%2F%2Ftracker%3A80&tr=http%3A%2F%2Fother%2Fannounce'
+        )
+        self.assertEqual(info_hash, 'abcdef0123456789abcdef0123456789abcdef01')
+        self.assertEqual(name, 'Some File')
+        self.assertEqual(trackers, ('udp://tracker:80', 'http://other/announce'))
+
+    def test_base32_btih(self):
+        info_hash, _, _ = _parse_magnet('magnet:?xt=urn:btih:CIMHHQDDWVSKTGKEUMR7YTG4BB5JMZOL')
+        self.assertEqual(info_hash, '121873c063b564a99944a323fc4cdc087a9665cb')
+
+    def test_invalid_btih_falls_back(self):
+        link = 'magnet:?xt=urn:btih:not-a-hash'
+        info_hash, _, _ = _parse_magnet(link)
+        self.assertEqual(info_hash, hashlib.sha1(link.encode()).hexdigest())
+
+    def test_without_btih(self):
+        link = 'magnet:?dn=name'
+        info_hash, name, trackers = _parse_magnet(link)
+        self.assertEqual(info_hash, hashlib.sha1(link.encode()).hexdigest())
+        self.assertEqual(name, 'name')
+        self.assertEqual(trackers, ())
+
+
+class UdpTrackerTests(SimpleTestCase):
+    INFO_HASH = bytes(range(20))
+    PEER_ID = b'-PY0100-' + b'x' * 12
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+        self.url = 'udp://127.0.0.1:%d/announce' % self.server.getsockname()[1]
+        self.requests = []
+
+    def tearDown(self):
+        self.server.close()
+
+    def serve(self, announce_reply):
+        """Answer one connect and one announce request in the background"""
+        def run():
+            data, address = self.server.recvfrom(2048)
+            self.requests.append(data)
+            _, _, transaction_id = struct.unpack('>QII', data)
+            self.server.sendto(struct.pack('>IIQ', 0, transaction_id, 1234), address)
+
+            data, address = self.server.recvfrom(2048)
+            self.requests.append(data)
+            transaction_id = struct.unpack_from('>QII', data)[2]
+            self.server.sendto(announce_reply(transaction_id), address)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def test_announce(self):
+        peers = socket.inet_aton('1.2.3.4') + struct.pack('>H', 6881)
+        thread = self.serve(lambda tid: struct.pack('>IIIII', 1, tid, 1800, 0, 1) + peers)
+
+        result = udp_tracker.announce(self.url, self.INFO_HASH, self.PEER_ID, timeout=5)
+        thread.join()
+
+        self.assertEqual(result, peers)
+        protocol_id, action, _ = struct.unpack('>QII', self.requests[0])
+        self.assertEqual((protocol_id, action), (0x41727101980, 0))
+        announce = struct.unpack('>QII20s20sQQQIIIiH', self.requests[1])
+        self.assertEqual(announce[:2], (1234, 1))
+        self.assertEqual(announce[3:5], (self.INFO_HASH, self.PEER_ID))
+
+    def test_tracker_error(self):
+        thread = self.serve(lambda tid: struct.pack('>II', 3, tid) + b'torrent not registered')
+
+        with self.assertRaisesMessage(ValueError, 'torrent not registered'):
+            udp_tracker.announce(self.url, self.INFO_HASH, self.PEER_ID, timeout=5)
+        thread.join()
+
+    def test_invalid_url(self):
+        with self.assertRaises(ValueError):
+            udp_tracker.announce('udp://tracker-without-port/announce', self.INFO_HASH, self.PEER_ID)
+
+
+class FakePieceManager:
+    """Records delivered blocks; hands out no requests"""
+
+    num_pieces = 8
+    REQUEST_TIMEOUT = PieceManager.REQUEST_TIMEOUT
+
+    def __init__(self):
+        self.blocks = []
+
+    def get_next_request(self):
+        return None
+
+    def release_requests(self, requests):
+        pass
+
+    def add_block(self, piece_index, offset, data):
+        self.blocks.append((piece_index, offset, bytes(data)))
+
+
+def connected_peer(piece_manager):
+    """A PeerConnection on one end of a socketpair, and the other end"""
+    ours, theirs = socket.socketpair()
+    peer = PeerConnection('127.0.0.1', 6881, '00' * 20, b'x' * 20, piece_manager)
+    peer.socket = ours
+    peer.connected = True
+    return peer, theirs
+
+
+def wait_for(condition, timeout=2):
+    """Poll until condition() is true or the timeout expires"""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class PeerIOLoopTests(SimpleTestCase):
+    def setUp(self):
+        self.loop = PeerIOLoop()
+        self.loop.start()
+
+    def tearDown(self):
+        self.loop.stop()
+
+    def test_oversized_message_drops_only_that_peer(self):
+        bad, bad_remote = connected_peer(FakePieceManager())
+        good, good_remote = connected_peer(FakePieceManager())
+        self.addCleanup(bad_remote.close)
+        self.addCleanup(good_remote.close)
+        self.loop.register(bad)
+        self.loop.register(good)
+
+        with self.assertLogs('downloader.peer_protocol', 'WARNING'):
+            bad_remote.sendall(struct.pack('>IB', 0xFFFFFFF0, 7))
+            self.assertTrue(wait_for(lambda: not bad.connected))
+
+        good_remote.sendall(struct.pack('>IB', 1, 1))  # unchoke
+        self.assertTrue(wait_for(lambda: not good.peer_choking))
+        self.assertTrue(self.loop._thread.is_alive())
+
+
+BLOCK = PieceManager.BLOCK_SIZE
+
+
+def make_piece_manager(test, data, piece_length, save_path=None, **attrs):
+    """A PieceManager downloading data into a temp dir, closed on cleanup"""
+    if save_path is None:
+        save_path = tempfile.mkdtemp()
+        test.addCleanup(shutil.rmtree, save_path, True)
+    pieces = [data[i:i + piece_length] for i in range(0, len(data), piece_length)]
+    torrent_info = {
+        'name': 'file.bin',
+        'num_pieces': len(pieces),
+        'piece_length': piece_length,
+        'total_size': len(data),
+        'pieces_hash': b''.join(hashlib.sha1(piece).digest() for piece in pieces),
+    }
+    piece_manager = PieceManager(torrent_info, save_path)
+    test.addCleanup(piece_manager.close)
+    for name, value in attrs.items():
+        setattr(piece_manager, name, value)
+    return piece_manager
+
+
+def read_requests(sock):
+    """Read every REQUEST message currently queued on sock"""
+    sock.setblocking(False)
+    data = b''
+    try:
+        while True:
+            data += sock.recv(65536)
+    except BlockingIOError:
+        pass
+    return [struct.unpack_from('>IBIII', data, i)[2:] for i in range(0, len(data), 17)]
+
+
+class RequestPipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.piece_manager = make_piece_manager(
+            self, os.urandom(4 * BLOCK), 2 * BLOCK, REQUEUE_INTERVAL=0, ENDGAME_FRACTION=1.0
+        )
+        self.peer, self.remote = connected_peer(self.piece_manager)
+        self.addCleanup(self.remote.close)
+        self.peer.peer_choking = False
+
+    def test_fills_window(self):
+        self.peer.window = 3
+        self.assertEqual(self.peer.fill_pipeline(), 3)
+        self.assertEqual(len(read_requests(self.remote)), 3)
+        self.assertEqual(self.peer.outstanding_requests, 3)
+
+    def test_endgame_does_not_rerequest_from_same_peer(self):
+        self.assertEqual(self.peer.fill_pipeline(), 4)
+        self.assertEqual(len(read_requests(self.remote)), 4)
+
+        # Endgame hands the same blocks out again; this peer already has them
+        self.assertEqual(self.peer.fill_pipeline(), 0)
+        self.assertEqual(read_requests(self.remote), [])
+        self.assertEqual(self.peer.outstanding_requests, 4)
+
+    def test_release_requests_requeues_immediately(self):
+        piece_manager = make_piece_manager(self, os.urandom(4 * BLOCK), 2 * BLOCK)
+        self.assertEqual(len(drain_requests(piece_manager)), 4)
+        piece_manager.release_requests([(1, BLOCK), (0, 0)])
+        self.assertEqual(drain_requests(piece_manager), [(1, BLOCK, BLOCK), (0, 0, BLOCK)])
+
+    def test_choke_releases_requests(self):
+        self.piece_manager.ENDGAME_FRACTION = 0
+        self.assertEqual(self.peer.fill_pipeline(), 4)
+        self.remote.sendall(struct.pack('>IB', 1, 0))  # choke
+        self.assertTrue(self.peer.on_readable())
+
+        self.assertTrue(self.peer.peer_choking)
+        self.assertEqual(self.peer.outstanding_requests, 0)
+        self.assertEqual(len(drain_requests(self.piece_manager)), 4)
+
+    def test_close_releases_requests(self):
+        self.piece_manager.ENDGAME_FRACTION = 0
+        self.assertEqual(self.peer.fill_pipeline(), 4)
+        self.peer.close()
+        self.assertEqual(len(drain_requests(self.piece_manager)), 4)
+
+    def test_timed_out_requests_released_and_peer_snubbed(self):
+        self.piece_manager.ENDGAME_FRACTION = 0
+        self.assertEqual(self.peer.fill_pipeline(), 4)
+        read_requests(self.remote)
+        self.piece_manager.REQUEST_TIMEOUT = 0
+
+        # The expired blocks go back to the queue; a snubbed peer gets one
+        self.assertEqual(self.peer.fill_pipeline(), 1)
+        self.assertTrue(self.peer.snubbed)
+        self.assertEqual(self.peer.outstanding_requests, 1)
+
+    def test_paused_peer_sends_no_requests(self):
+        self.peer.pause_event = threading.Event()
+        self.peer.pause_event.set()
+        self.assertEqual(self.peer.fill_pipeline(), 0)
+        self.assertEqual(read_requests(self.remote), [])
+
+
+def deliver(piece_manager, data, piece_index, block_indices=None):
+    """Hand a piece's blocks (all, in order, by default) to the piece manager"""
+    start = piece_index * piece_manager.piece_length
+    piece = data[start:start + piece_manager._get_piece_size(piece_index)]
+    if block_indices is None:
+        block_indices = range(piece_manager._get_num_blocks(piece_index))
+    for block_index in block_indices:
+        offset = block_index * BLOCK
+        piece_manager.add_block(piece_index, offset, piece[offset:offset + BLOCK])
+
+
+def drain_requests(piece_manager):
+    """Every request get_next_request hands out until it returns None"""
+    requests = []
+    request = piece_manager.get_next_request()
+    while request is not None:
+        requests.append(request)
+        request = piece_manager.get_next_request()
+    return requests
+
+
+class PieceQueueTests(SimpleTestCase):
+    def test_hands_out_every_block_once(self):
+        data = os.urandom(5 * BLOCK + 100)
+        piece_manager = make_piece_manager(self, data, 2 * BLOCK)
+        self.assertEqual(drain_requests(piece_manager), [
+            (0, 0, BLOCK), (0, BLOCK, BLOCK),
+            (1, 0, BLOCK), (1, BLOCK, BLOCK),
+            (2, 0, BLOCK), (2, BLOCK, 100),
+        ])
+
+    def test_skips_downloaded_pieces(self):
+        data = os.urandom(4 * BLOCK)
+        piece_manager = make_piece_manager(self, data, 2 * BLOCK)
+        deliver(piece_manager, data, 0)
+        self.assertEqual(drain_requests(piece_manager), [(1, 0, BLOCK), (1, BLOCK, BLOCK)])
+
+
+class IncrementalHashTests(SimpleTestCase):
+    def test_out_of_order_blocks(self):
+        data = os.urandom(6 * BLOCK - 10)
+        piece_manager = make_piece_manager(self, data, 3 * BLOCK)
+        deliver(piece_manager, data, 0, [2, 0, 1])
+        deliver(piece_manager, data, 1, [2, 1, 0])
+
+        self.assertTrue(piece_manager.is_complete())
+        piece_manager.close()
+        with open(piece_manager.file_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_hash_mismatch_requeues_piece(self):
+        data = os.urandom(4 * BLOCK)
+        piece_manager = make_piece_manager(self, data, 2 * BLOCK)
+        self.assertEqual(piece_manager.get_next_request(), (0, 0, BLOCK))
+        self.assertEqual(piece_manager.get_next_request(), (0, BLOCK, BLOCK))
+
+        with self.assertLogs('downloader.piece_manager', 'WARNING'):
+            piece_manager.add_block(0, BLOCK, data[BLOCK:2 * BLOCK])
+            piece_manager.add_block(0, 0, b'\x00' * BLOCK)
+
+        self.assertFalse(piece_manager.pieces[0]['downloaded'])
+        self.assertEqual(piece_manager.get_next_request(), (0, 0, BLOCK))
+
+
+class MessageFramingTests(SimpleTestCase):
+    def setUp(self):
+        self.piece_manager = FakePieceManager()
+        self.peer, self.remote = connected_peer(self.piece_manager)
+        self.addCleanup(self.remote.close)
+        self.addCleanup(self.peer.socket.close)
+
+    def feed(self, stream, sizes):
+        """Send stream in chunks of the given sizes (cycled), reading after each
+
+        Reads repeat while the socket is readable, as PeerIOLoop's
+        level-triggered selector would.
+        """
+        pos = 0
+        i = 0
+        while pos < len(stream):
+            chunk = stream[pos:pos + sizes[i % len(sizes)]]
+            self.remote.sendall(chunk)
+            while select.select([self.peer.socket], [], [], 0)[0]:
+                self.assertTrue(self.peer.on_readable())
+            pos += len(chunk)
+            i += 1
+
+    def test_messages_split_across_reads(self):
+        block = os.urandom(BLOCK)
+        stream = (
+            struct.pack('>I', 0)  # keep-alive
+            + struct.pack('>IB', 2, 5) + b'\xa5'  # bitfield
+            + struct.pack('>IB', 1, 1)  # unchoke
+            + struct.pack('>IBII', 9 + BLOCK, 7, 3, BLOCK) + block  # piece
+            + struct.pack('>IBI', 5, 4, 6)  # have
+            + struct.pack('>IBII', 9 + 10, 7, 4, 0) + block[:10]
+        )
+        self.feed(stream, [1, 3, 2, 1000, 5])
+
+        self.assertEqual(self.peer.bitfield, b'\xa5')
+        self.assertFalse(self.peer.peer_choking)
+        self.assertEqual(self.piece_manager.blocks, [(3, BLOCK, block), (4, 0, block[:10])])
+        self.assertEqual(self.peer._in_end, 0)
+
+    def test_message_larger_than_receive_buffer(self):
+        data = os.urandom(8 * BLOCK)
+        stream = struct.pack('>IBII', 9 + len(data), 7, 1, 0) + data + struct.pack('>IB', 1, 1)
+        self.feed(stream, [4096])
+
+        self.assertEqual(self.piece_manager.blocks, [(1, 0, data)])
+        self.assertFalse(self.peer.peer_choking)
+
+
+class InflightRequestTests(SimpleTestCase):
+    def setUp(self):
+        self.data = os.urandom(4 * BLOCK)
+
+    def test_inflight_blocks_not_handed_out_again(self):
+        piece_manager = make_piece_manager(self, self.data, 2 * BLOCK, REQUEUE_INTERVAL=0)
+        self.assertEqual(len(drain_requests(piece_manager)), 4)
+        self.assertEqual(drain_requests(piece_manager), [])
+
+    def test_timed_out_blocks_handed_out_again(self):
+        piece_manager = make_piece_manager(
+            self, self.data, 2 * BLOCK, REQUEUE_INTERVAL=0, REQUEST_TIMEOUT=0.05
+        )
+        self.assertEqual(len(drain_requests(piece_manager)), 4)
+        deliver(piece_manager, self.data, 0, [0])
+        time.sleep(0.1)
+
+        # The delivered block is not requested again
+        self.assertEqual(drain_requests(piece_manager), [
+            (0, BLOCK, BLOCK), (1, 0, BLOCK), (1, BLOCK, BLOCK),
+        ])
+
+    def test_endgame_hands_out_inflight_blocks(self):
+        piece_manager = make_piece_manager(
+            self, self.data, 2 * BLOCK, REQUEUE_INTERVAL=0, ENDGAME_FRACTION=1.0
+        )
+        self.assertEqual(len(drain_requests(piece_manager)), 4)
+        deliver(piece_manager, self.data, 1)
+        self.assertEqual(piece_manager.get_next_request(), (0, 0, BLOCK))
+
+
+class ResumeTests(SimpleTestCase):
+    def setUp(self):
+        self.save_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_path, True)
+        self.data = os.urandom(6 * BLOCK)
+
+    def start(self):
+        return make_piece_manager(self, self.data, 2 * BLOCK, self.save_path)
+
+    def test_resumes_written_pieces(self):
+        piece_manager = self.start()
+        deliver(piece_manager, self.data, 0)
+        deliver(piece_manager, self.data, 2)
+        piece_manager.close()
+        self.assertTrue(os.path.exists(piece_manager.state_path))
+
+        piece_manager = self.start()
+        self.assertEqual(piece_manager._downloaded_count, 2)
+        self.assertEqual(drain_requests(piece_manager), [(1, 0, BLOCK), (1, BLOCK, BLOCK)])
+
+    def test_corrupt_piece_downloaded_again(self):
+        piece_manager = self.start()
+        for piece_index in range(2):
+            deliver(piece_manager, self.data, piece_index)
+        piece_manager.close()
+        with open(piece_manager.file_path, 'r+b') as f:
+            f.seek(2 * BLOCK)
+            f.write(b'\x00' * 10)
+
+        piece_manager = self.start()
+        self.assertEqual(piece_manager._downloaded_count, 1)
+        self.assertFalse(piece_manager.pieces[1]['downloaded'])
+        self.assertEqual(piece_manager.get_next_request(), (1, 0, BLOCK))
+
+    def test_state_removed_when_complete(self):
+        piece_manager = self.start()
+        for piece_index in range(3):
+            deliver(piece_manager, self.data, piece_index)
+        piece_manager.close()
+        self.assertFalse(os.path.exists(piece_manager.state_path))
+        with open(piece_manager.file_path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
@@ -0,0 +1,76 @@
+"""
+BitTorrent UDP Tracker Protocol (BEP 15)
+Connect/announce exchange returning the compact peer list
+"""
+
+import random
+import socket
+import struct
+from urllib.parse import urlsplit
+
+
+_PROTOCOL_ID = 0x41727101980  # Magic constant for the connect request
+_ACTION_CONNECT = 0
+_ACTION_ANNOUNCE = 1
+_ACTION_ERROR = 3
+_EVENT_STARTED = 2
+
+_CONNECT_REQ = struct.Struct(">QII")        # protocol_id, action, transaction_id
+_CONNECT_RESP = struct.Struct(">IIQ")       # action, transaction_id, connection_id
+_ANNOUNCE_REQ = struct.Struct(">QII20s20sQQQIIIiH")
+_ANNOUNCE_RESP = struct.Struct(">IIIII")    # action, transaction_id, interval, leechers, seeders
+_HEADER = struct.Struct(">II")              # action, transaction_id
+
+
+def announce(tracker_url, info_hash, peer_id, port=6881, timeout=5):
+    """Announce to a udp:// tracker and return its compact peer list (bytes)
+
+    info_hash is the 20-byte binary hash. Raises OSError on network
+    errors or timeouts and ValueError on malformed or error responses.
+    """
+    parsed = urlsplit(tracker_url)
+    if not parsed.hostname or not parsed.port:
+        raise ValueError(f"Invalid UDP tracker URL: {tracker_url}")
+    address = (parsed.hostname, parsed.port)
+    
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        
+        # Connect: obtain a connection id for the announce
+        transaction_id = random.getrandbits(32)
+        sock.sendto(_CONNECT_REQ.pack(_PROTOCOL_ID, _ACTION_CONNECT, transaction_id), address)
+        response = _receive(sock, _ACTION_CONNECT, transaction_id, _CONNECT_RESP.size)
+        _, _, connection_id = _CONNECT_RESP.unpack_from(response)
+        
+        # Announce
+        transaction_id = random.getrandbits(32)
+        request = _ANNOUNCE_REQ.pack(
+            connection_id, _ACTION_ANNOUNCE, transaction_id,
+            info_hash, peer_id,
+            0, 0, 0,  # downloaded, left, uploaded
+            _EVENT_STARTED,
+            0,  # IP address: use the sender's
+            random.getrandbits(32),  # key
+            -1,  # num_want: tracker default
+            port,
+        )
+        sock.sendto(request, address)
+        response = _receive(sock, _ACTION_ANNOUNCE, transaction_id, _ANNOUNCE_RESP.size)
+        return response[_ANNOUNCE_RESP.size:]
+
+
+def _receive(sock, action, transaction_id, min_size):
+    """Receive the response to a request and validate its header"""
+    response, _ = sock.recvfrom(65536)
+    if len(response) < _HEADER.size:
+        raise ValueError("Truncated tracker response")
+    
+    resp_action, resp_transaction_id = _HEADER.unpack_from(response)
+    if resp_transaction_id != transaction_id:
+        raise ValueError("Tracker response transaction id mismatch")
+    if resp_action == _ACTION_ERROR:
+        message = response[_HEADER.size:].decode('utf-8', errors='ignore')
+        raise ValueError(f"Tracker error: {message}")
+    if resp_action != action or len(response) < min_size:
+        raise ValueError("Unexpected tracker response")
+    return response
@@ -6,22 +6,10 @@ from django.conf import settings
 from django.utils import timezone
 from .models import TorrentTask
 
-class TorrentManager:
-    _instance = None
-    _lock = threading.Lock()
-
-    def __new__(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super(TorrentManager, cls).__new__(cls)
-                    cls._instance._initialized = False
-        return cls._instance
+class _TorrentManagerImpl:
+    """Use get_manager(); one instance per process owns the download engine"""
 
     def __init__(self):
-        if self._initialized:
-            return
-        
         self.session = lt.session()
         self.session.listen_on(6881, 6891)
         self.output_dir = settings.TORRENT_SAVE_PATH
@@ -33,7 +21,6 @@ class TorrentManager:
         self.running = False
         self._load_existing_torrents()
         self.start_monitoring()
-        self._initialized = True
 
     def _load_existing_torrents(self):
         """Loads torrents from DB on startup"""
@@ -94,43 +81,76 @@ class TorrentManager:
             self.running = True
             threading.Thread(target=self._monitor_loop, daemon=True).start()
 
+    # Fields written back to TorrentTask on every monitor tick
+    SYNC_FIELDS = ['progress', 'download_speed', 'upload_speed', 'status', 'name']
+
     def _monitor_loop(self):
         while self.running:
             # Update libtorrent session
             # params = lt.session_params()
             # self.session.post_torrent_updates() # Only if using alerts, but detailed loop is easier for MVP
             
-            for info_hash, handle in list(self.handles.items()):
-                try:
-                    status = handle.status()
-                    task = TorrentTask.objects.get(info_hash=info_hash)
-                    
-                    task.progress = status.progress * 100
-                    task.download_speed = status.download_rate
-                    task.upload_speed = status.upload_rate
-                    task.name = handle.name() # Update name if magnet resolved
-                    
-                    # Update status state
-                    if status.is_seeding:
-                        task.status = 'seeding'
-                    elif status.state == lt.torrent_status.checking_files:
-                        task.status = 'checking'
-                    elif status.paused:
-                        task.status = 'paused'
-                    else:
-                        task.status = 'downloading'
-                        
-                    if task.progress >= 100:
-                         task.status = 'completed'
-                         task.completed_at = timezone.now()
-
-                    task.save()
-                    
-                except Exception as e:
-                    print(f"Error updating torrent {info_hash}: {e}")
+            try:
+                self._sync_tasks()
+            except Exception as e:
+                print(f"Error updating torrents: {e}")
             
             time.sleep(1)
 
+    def _sync_tasks(self):
+        """Copy handle status into TorrentTask rows with one read and one write"""
+        handles = list(self.handles.items())
+        if not handles:
+            return
+        
+        tasks_by_hash = TorrentTask.objects.in_bulk(
+            [info_hash for info_hash, _ in handles], field_name='info_hash'
+        )
+        updated = []
+        just_completed = []  # Also need completed_at
+        
+        for info_hash, handle in handles:
+            task = tasks_by_hash.get(info_hash)
+            if task is None:
+                continue
+            try:
+                status = handle.status()
+                was_completed = task.status == 'completed'
+                
+                task.progress = status.progress * 100
+                task.download_speed = status.download_rate
+                task.upload_speed = status.upload_rate
+                task.name = handle.name() # Update name if magnet resolved
+                
+                # Update status state
+                if status.is_seeding:
+                    task.status = 'seeding'
+                elif status.state == lt.torrent_status.checking_files:
+                    task.status = 'checking'
+                elif status.paused:
+                    task.status = 'paused'
+                else:
+                    task.status = 'downloading'
+                    
+                if task.progress >= 100:
+                     task.status = 'completed'
+                
+                if task.status == 'completed' and not was_completed:
+                    task.completed_at = timezone.now()
+                    just_completed.append(task)
+                else:
+                    updated.append(task)
+                
+            except Exception as e:
+                print(f"Error updating torrent {info_hash}: {e}")
+        
+        if updated:
+            TorrentTask.objects.bulk_update(updated, self.SYNC_FIELDS, batch_size=100)
+        if just_completed:
+            TorrentTask.objects.bulk_update(
+                just_completed, self.SYNC_FIELDS + ['completed_at'], batch_size=100
+            )
+
     def pause_torrent(self, info_hash):
         if info_hash in self.handles:
             self.handles[info_hash].pause()
@@ -144,3 +164,18 @@ class TorrentManager:
             self.session.remove_torrent(self.handles[info_hash], delete_files)
             del self.handles[info_hash]
             TorrentTask.objects.filter(info_hash=info_hash).delete()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """Return the process-wide torrent manager, creating it on first use"""
+    global _manager
+    if _manager is None:
+        # Only the first calls take the lock; two managers would mean two engines
+        with _manager_lock:
+            if _manager is None:
+                _manager = _TorrentManagerImpl()
+    return _manager
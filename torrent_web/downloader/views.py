@@ -3,7 +3,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from .models import TorrentTask
-from .services import TorrentManager
+from .services import get_manager
 import os
 
 def dashboard(request):
@@ -15,7 +15,7 @@ def add_torrent(request):
         magnet = request.POST.get('magnet_link')
         torrent_file = request.FILES.get('torrent_file')
         
-        manager = TorrentManager()
+        manager = get_manager()
         
         if magnet:
             manager.add_magnet(magnet)
@@ -38,7 +38,7 @@ def api_status(request):
     return JsonResponse({'tasks': list(tasks)})
 
 def control_torrent(request, task_id, action):
-    manager = TorrentManager()
+    manager = get_manager()
     try:
         task = TorrentTask.objects.get(id=task_id)
         if action == 'pause':
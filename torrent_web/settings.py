@@ -133,3 +133,39 @@ TORRENT_SAVE_PATH = BASE_DIR / 'downloads'
 # Allow larger request bodies for torrent file uploads (e.g. 10MB)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760
 
+
+# Logging
+# The downloader logger's handlers are moved behind a QueueHandler in
+# DownloaderConfig.ready, so peer and piece threads never block on console
+# or file I/O; a QueueListener does the writing on its own thread.
+TORRENT_LOG_FILE = Path(os.environ.get('TORRENT_LOG_FILE', BASE_DIR / 'logs' / 'torrent.log'))
+os.makedirs(TORRENT_LOG_FILE.parent, exist_ok=True)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'torrent': {'format': '%(asctime)s [%(levelname)s] %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'torrent_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'torrent',
+        },
+        'torrent_file': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'formatter': 'torrent',
+            'filename': TORRENT_LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'downloader': {
+            'handlers': ['torrent_console', 'torrent_file'],
+            'level': os.environ.get('TORRENT_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}